@@ -0,0 +1,323 @@
+"""
+Benchmarks for the posts API
+
+Seeds the database with a number of posts then drives every endpoint,
+either in process through the Flask test client or over HTTP against a
+threaded WSGI server, and reports throughput and latency percentiles for
+each scenario and the peak memory of the run.
+
+    python benchmarks/bench.py --posts 10000 --requests 500
+    python benchmarks/bench.py --server --concurrency 8 --save base.json
+    python benchmarks/bench.py --compare base.json
+
+Runs against SQLite by default, set BENCH_DATABASE_URI to use Postgres.
+"""
+import os
+import sys
+import json
+import time
+import random
+import httplib
+import argparse
+import resource
+import threading
+from Queue import Queue, Empty
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("CONFIG_PATH", "posts.config.BenchmarkConfig")
+
+from posts import app
+from posts import bulk
+from posts.database import Base, get_engine, init_db, session
+
+
+JSON = "application/json"
+
+# Seeded posts removed by each request of the delete scenarios, as every
+# delete takes posts no other request has deleted
+DELETED_PER_REQUEST = {"delete": 1, "delete_many": 10}
+
+
+def seed(count, chunk_size=1000):
+    """ Recreate the tables and fill them with count posts """
+    Base.metadata.drop_all(get_engine(app))
+    init_db(app)
+    words = ["bells", "whistles", "flask", "api", "posts", "test", "bench"]
+    with app.app_context():
+        for start in range(0, count, chunk_size):
+            rows = []
+            for i in range(start, min(start + chunk_size, count)):
+                title = "Post {} about {}".format(i, random.choice(words))
+                body = " ".join(random.choice(words) for _ in range(50))
+                rows.append({"title": title, "body": body})
+            bulk.insert_posts(session, rows)
+            session.commit()
+
+
+def scenarios(count):
+    """
+    Requests for each scenario, as functions returning the method, path,
+    body and content type for a single request
+    """
+    def random_id():
+        return random.randint(1, count)
+
+    def new_post():
+        return json.dumps({"title": "Benchmark post", "body": "Just a test"})
+
+    def new_posts():
+        return json.dumps([{"title": "Benchmark post", "body": "Just a test"}
+                           for _ in range(100)])
+
+    def random_ids():
+        return ",".join(str(random_id()) for _ in range(10))
+
+    # Seeded posts are deleted from the highest id down
+    deletable = list(range(1, count + 1))
+
+    def deleted_ids():
+        return ",".join(str(deletable.pop()) for _ in
+                        range(DELETED_PER_REQUEST["delete_many"]))
+
+    return [
+        ("list", lambda: ("GET", "/api/posts", None, None)),
+        ("list_page", lambda: ("GET", "/api/posts?limit=100&after_id={}"
+                               .format(random_id()), None, None)),
+        ("list_title_like", lambda: ("GET", "/api/posts?title_like=whistles",
+                                     None, None)),
+        ("search", lambda: ("GET", "/api/posts?q=bells+whistles",
+                            None, None)),
+        ("stream", lambda: ("GET", "/api/posts?stream=true", None, None)),
+        ("get", lambda: ("GET", "/api/posts/{}".format(random_id()),
+                         None, None)),
+        ("lookup", lambda: ("GET", "/api/posts?ids={}".format(random_ids()),
+                            None, None)),
+        ("count", lambda: ("GET", "/api/posts/count", None, None)),
+        ("stats", lambda: ("GET", "/api/posts/stats?title_like=whistles",
+                           None, None)),
+        ("changes", lambda: ("GET", "/api/posts/changes?since={}".format(
+            random_id()), None, None)),
+        ("create", lambda: ("POST", "/api/posts", new_post(), JSON)),
+        ("bulk_create", lambda: ("POST", "/api/posts/bulk", new_posts(),
+                                 JSON)),
+        ("delete", lambda: ("DELETE", "/api/post/{}".format(deletable.pop()),
+                            None, None)),
+        ("delete_many", lambda: ("DELETE", "/api/posts?ids={}".format(
+            deleted_ids()), None, None)),
+    ]
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    """ Serve the app from a threaded WSGI server on a free port """
+    server = make_server("127.0.0.1", 0, app, ThreadingWSGIServer,
+                         QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def client_sender():
+    """ Send a request through the Flask test client """
+    client = app.test_client()
+
+    def send(method, path, body, content_type):
+        # Buffering reads the whole body, so streamed responses are
+        # timed until their last chunk like they are over HTTP
+        response = client.open(path, method=method, data=body,
+                               content_type=content_type,
+                               headers=[("Accept", JSON)], buffered=True)
+        return response.status_code
+    return send
+
+
+def http_sender(port):
+    """ Send a request over HTTP to the WSGI server """
+    def send(method, path, body, content_type):
+        connection = httplib.HTTPConnection("127.0.0.1", port)
+        headers = {"Accept": JSON}
+        if content_type:
+            headers["Content-Type"] = content_type
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        return response.status
+    return send
+
+
+def run_scenario(make_request, requests, concurrency, make_sender):
+    """ Run requests across concurrency threads and time each of them """
+    todo = Queue()
+    for _ in range(requests):
+        todo.put(make_request())
+    latencies = []
+    errors = []
+
+    def worker():
+        send = make_sender()
+        while True:
+            try:
+                request = todo.get_nowait()
+            except Empty:
+                return
+            start = time.time()
+            try:
+                status = send(*request)
+            except Exception as error:
+                errors.append(type(error).__name__)
+                continue
+            latencies.append(time.time() - start)
+            if status >= 400:
+                errors.append(str(status))
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    return latencies, errors, elapsed
+
+
+def percentile(values, fraction):
+    """ Value below which the given fraction of sorted values fall """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+
+def peak_rss_kb():
+    """
+    Peak resident memory of the process in kilobytes. It only ever grows,
+    so it is reported for the whole run rather than per scenario.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def report(results, baseline=None):
+    """ Print a table of results, with the change from a baseline run """
+    columns = ["throughput", "p50_ms", "p95_ms", "p99_ms"]
+    print("{:<16} {:>8} {:>7} ".format("scenario", "requests", "errors") +
+          " ".join("{:>16}".format(column) for column in columns))
+    for name, result in results:
+        cells = []
+        for column in columns:
+            cell = "{:.1f}".format(result[column])
+            if baseline and name in baseline:
+                before = baseline[name][column]
+                if before:
+                    change = (result[column] - before) * 100.0 / before
+                    cell += " ({:+.0f}%)".format(change)
+            cells.append("{:>16}".format(cell))
+        row = "{:<16} {:>8} {:>7} ".format(name, result["requests"],
+                                           result["errors"])
+        print(row + " ".join(cells))
+    print("peak_rss_kb: {}".format(peak_rss_kb()))
+
+
+def regressions(results, baseline, threshold):
+    """ Scenarios which got slower than the baseline by over threshold """
+    slower = []
+    for name, result in results:
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if before["p95_ms"] and \
+                result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            slower.append(name)
+        elif result["throughput"] < before["throughput"] * (1 - threshold):
+            slower.append(name)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--posts", type=int, default=10000,
+                        help="number of posts to seed")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="client threads sending requests")
+    parser.add_argument("--server", action="store_true",
+                        help="send requests over HTTP to a WSGI server")
+    parser.add_argument("--only", action="append",
+                        help="run only the named scenario")
+    parser.add_argument("--save", help="write results to a JSON file")
+    parser.add_argument("--compare",
+                        help="compare with results saved by --save")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fractional slowdown counted as a regression")
+    args = parser.parse_args()
+    deleted = sum(count * args.requests
+                  for name, count in DELETED_PER_REQUEST.items()
+                  if not args.only or name in args.only)
+    if deleted > args.posts:
+        parser.error("the delete scenarios remove {} posts, more than "
+                     "--posts".format(deleted))
+
+    seed(args.posts)
+
+    if args.server:
+        server = start_server()
+        make_sender = lambda: http_sender(server.server_port)
+    else:
+        make_sender = client_sender
+
+    results = []
+    for name, make_request in scenarios(args.posts):
+        if args.only and name not in args.only:
+            continue
+        result = run_scenario(make_request, args.requests, args.concurrency,
+                              make_sender)
+        results.append((name, summarize(*result)))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        # Files saved before the run level fields were added only hold
+        # the scenarios
+        baseline = baseline.get("scenarios", baseline)
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump({"scenarios": dict(results),
+                       "peak_rss_kb": peak_rss_kb()},
+                      results_file, indent=2)
+
+    if baseline:
+        slower = regressions(results, baseline, args.threshold)
+        if slower:
+            print("Regressions: {}".format(", ".join(slower)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
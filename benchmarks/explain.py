@@ -0,0 +1,131 @@
+"""
+Query plan checks for the posts API
+
+Seeds a Postgres database, records the SQL each read and delete endpoint
+runs, then EXPLAINs every statement and fails if any of them scans the
+whole posts or post_terms table instead of using an index.
+
+    BENCH_DATABASE_URI=postgresql://localhost/posts-bench \\
+        python benchmarks/explain.py --posts 50000
+
+Streaming the full list is left out as it reads every post on purpose.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("CONFIG_PATH", "posts.config.BenchmarkConfig")
+
+from sqlalchemy import event
+
+from posts import app
+from posts.database import get_engine
+
+from bench import seed
+
+
+# Plan nodes which read a whole table
+FULL_SCANS = ("Seq Scan on posts", "Seq Scan on post_terms")
+
+# Filters which scan the whole result match a single seeded post, as a
+# sequential scan is the best plan for words most posts contain
+REQUESTS = [
+    ("list", "GET", "/api/posts"),
+    ("list_page", "GET", "/api/posts?limit=100&after_id={middle}"),
+    ("list_title_like", "GET", "/api/posts?title_like=whistles"),
+    ("list_body_like", "GET", "/api/posts?body_like=bells+whistles"),
+    ("search", "GET", "/api/posts?q={middle}"),
+    ("lookup", "GET", "/api/posts?ids={middle},{after},{before}"),
+    ("get", "GET", "/api/posts/{middle}"),
+    ("count_title_like", "GET",
+     "/api/posts/count?title_like=Post+{middle}+about"),
+    ("stats_title_like", "GET",
+     "/api/posts/stats?title_like=Post+{middle}+about"),
+    ("changes", "GET", "/api/posts/changes?since={middle}"),
+    ("delete", "DELETE", "/api/post/{middle}"),
+    ("delete_many", "DELETE", "/api/posts?ids={after},{before}"),
+]
+
+
+def capture(engine, name, statements):
+    """ Record the statements run on the engine against the scenario name """
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "DELETE")):
+            statements.append((name, statement, parameters))
+    return listener
+
+
+def explain(engine, statement, parameters):
+    """ The query plan for a statement, as a list of lines """
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        # EXPLAIN without ANALYZE plans the statement but never runs it, so
+        # the deletes leave the data alone
+        cursor.execute("EXPLAIN " + statement, parameters)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--posts", type=int, default=50000,
+                        help="number of posts to seed")
+    parser.add_argument("--verbose", action="store_true",
+                        help="print every plan")
+    args = parser.parse_args()
+
+    engine = get_engine(app)
+    if engine.dialect.name != "postgresql":
+        sys.exit("Plan checks need Postgres, set BENCH_DATABASE_URI")
+
+    seed(args.posts)
+    # Fresh statistics so the planner knows how big the tables are
+    with engine.connect() as connection:
+        connection.execution_options(autocommit=True).execute("ANALYZE")
+
+    statements = []
+    client = app.test_client()
+    for name, method, path in REQUESTS:
+        # Posts cached by an earlier request would be served without SQL
+        app.extensions["posts.cache"].clear()
+        captured = len(statements)
+        listener = capture(engine, name, statements)
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            middle = args.posts // 2
+            response = client.open(
+                path.format(middle=middle, before=middle - 1,
+                            after=middle + 1),
+                method=method, headers=[("Accept", "application/json")])
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        # A failed request may not have run the queries it should check
+        if response.status_code != 200:
+            sys.exit("{} failed with {}".format(name, response.status_code))
+        if len(statements) == captured:
+            sys.exit("{} ran no statements to check".format(name))
+
+    failures = 0
+    for name, statement, parameters in statements:
+        plan = explain(engine, statement, parameters)
+        scans = [line.strip() for line in plan
+                 if any(scan in line for scan in FULL_SCANS)]
+        if scans or args.verbose:
+            print("{}: {}".format(name, " ".join(statement.split())))
+            for line in plan:
+                print("    " + line)
+        if scans:
+            failures += 1
+            print("FULL SCAN in {}: {}\n".format(name, "; ".join(scans)))
+
+    print("{} statements checked, {} with full table scans".format(
+        len(statements), failures))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Load tests for the posts API
+
+Sends a mix of requests at a target concurrency and rate and reports
+latency percentiles, a latency histogram and the errors for each
+endpoint. The requests are either replayed from a JSONL log, one request
+per line:
+
+    {"method": "GET", "path": "/api/posts?limit=50"}
+    {"method": "POST", "path": "/api/posts",
+     "body": {"title": "A post", "body": "Some text"}}
+
+with an optional "content_type" (JSON bodies default to application/json)
+and "name" to report the request under instead of its endpoint, or
+generated from a weighted read/write/search mix:
+
+    python benchmarks/loadtest.py --mix read=80,write=15,search=5 \\
+        --requests 5000 --concurrency 16 --rate 500
+    python benchmarks/loadtest.py --log traffic.jsonl --server
+
+With --rate, requests are sent on a fixed schedule and latency is counted
+from when each one was due, so time spent queued behind a slow server
+counts too. Runs against SQLite by default, set BENCH_DATABASE_URI to use
+Postgres.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from Queue import Queue, Empty
+from urlparse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("CONFIG_PATH", "posts.config.BenchmarkConfig")
+
+from werkzeug.exceptions import HTTPException
+
+from posts import app
+from posts.instrumentation import BUCKETS
+
+from bench import JSON, seed, start_server, client_sender, http_sender
+from bench import percentile
+
+
+WORDS = ["bells", "whistles", "flask", "api", "posts", "test", "bench"]
+
+
+def read_log(path):
+    """ Requests from a JSONL log, as (name, method, path, body, type) """
+    requests = []
+    with open(path) as log:
+        for line in log:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            body = entry.get("body")
+            content_type = entry.get("content_type")
+            if body is not None and not isinstance(body, basestring):
+                body = json.dumps(body)
+                content_type = content_type or JSON
+            requests.append((entry.get("name"), entry["method"].upper(),
+                             entry["path"], body, content_type))
+    return requests
+
+
+def parse_mix(mix):
+    """ Weights from a mix such as "read=80,write=15,search=5" """
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in ("read", "write", "search"):
+            raise argparse.ArgumentTypeError("Unknown kind {}".format(kind))
+        weights[kind] = float(weight)
+    return weights
+
+
+def generate(count, weights, posts):
+    """
+    Requests drawn at random from the read, write and search kinds in
+    proportion to their weights. Deletes take seeded posts from the
+    highest id down so each one finds a post.
+    """
+    deletable = list(range(1, posts + 1))
+
+    def random_id():
+        return random.randint(1, posts)
+
+    def read():
+        return random.choice([
+            ("list", "GET", "/api/posts?limit=50&after_id={}".format(
+                random_id()), None, None),
+            ("get", "GET", "/api/posts/{}".format(random_id()), None, None),
+            ("lookup", "GET", "/api/posts?ids={}".format(
+                ",".join(str(random_id()) for _ in range(10))), None, None),
+            ("count", "GET", "/api/posts/count", None, None)
+        ])
+
+    def write():
+        if deletable and random.random() < 0.2:
+            return ("delete", "DELETE",
+                    "/api/post/{}".format(deletable.pop()), None, None)
+        body = json.dumps({"title": "Load test post",
+                           "body": " ".join(random.sample(WORDS, 4))})
+        return ("create", "POST", "/api/posts", body, JSON)
+
+    def search():
+        return ("search", "GET", "/api/posts?q={}".format(
+            "+".join(random.sample(WORDS, 2))), None, None)
+
+    kinds = {"read": read, "write": write, "search": search}
+    total = sum(weights.values())
+    requests = []
+    for _ in range(count):
+        point = random.uniform(0, total)
+        for kind, weight in sorted(weights.items()):
+            point -= weight
+            if point <= 0:
+                break
+        requests.append(kinds[kind]())
+    return requests
+
+
+def endpoint_name(method, path):
+    """ The name of the endpoint which will handle a request """
+    adapter = app.url_map.bind("localhost")
+    try:
+        endpoint, _ = adapter.match(urlsplit(path).path, method)
+    except HTTPException:
+        return "unmatched"
+    return endpoint
+
+
+def run(requests, concurrency, rate, make_sender):
+    """
+    Send the requests from concurrency threads, at most rate a second if
+    given, and collect the latency and errors for each name
+    """
+    todo = Queue()
+    for index, request in enumerate(requests):
+        todo.put((index, request))
+    results = {}
+    lock = threading.Lock()
+
+    def record(name, latency, error):
+        with lock:
+            result = results.setdefault(name, {"requests": 0,
+                                               "latencies": [],
+                                               "errors": Counter()})
+            result["requests"] += 1
+            if latency is not None:
+                result["latencies"].append(latency)
+            if error:
+                result["errors"][error] += 1
+
+    def worker():
+        send = make_sender()
+        while True:
+            try:
+                index, (name, method, path, body, content_type) = \
+                    todo.get_nowait()
+            except Empty:
+                return
+            name = name or endpoint_name(method, path)
+            due = start + index / rate if rate else time.time()
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                status = send(method, path, body, content_type)
+            except Exception as error:
+                record(name, None, type(error).__name__)
+                continue
+            record(name, time.time() - due,
+                   str(status) if status >= 400 else None)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.time() - start
+
+
+def histogram(latencies):
+    """ Counts of latencies in each of the metrics buckets """
+    counts = [0] * (len(BUCKETS) + 1)
+    for latency in latencies:
+        for index, bound in enumerate(BUCKETS):
+            if latency <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+    return counts
+
+
+def summarize(result, elapsed):
+    latencies = sorted(result["latencies"])
+    return {
+        "requests": result["requests"],
+        "errors": dict(result["errors"]),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+        "histogram": histogram(latencies)
+    }
+
+
+def report(summaries):
+    """ Print a table of the endpoints then each one's histogram """
+    columns = ["throughput", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    print("{:<24} {:>8} {:>7} ".format("endpoint", "requests", "errors") +
+          " ".join("{:>10}".format(column) for column in columns))
+    for name, summary in sorted(summaries.items()):
+        row = "{:<24} {:>8} {:>7} ".format(
+            name, summary["requests"], sum(summary["errors"].values()))
+        print(row + " ".join("{:>10.1f}".format(summary[column])
+                             for column in columns))
+
+    labels = ["<= {:g}ms".format(bound * 1000) for bound in BUCKETS]
+    labels.append("> {:g}ms".format(BUCKETS[-1] * 1000))
+    for name, summary in sorted(summaries.items()):
+        print("\n{}".format(name))
+        most = max(summary["histogram"]) or 1
+        for label, count in zip(labels, summary["histogram"]):
+            print("  {:>12} {:>7} {}".format(label, count,
+                                              "#" * (40 * count // most)))
+        if summary["errors"]:
+            print("  errors: {}".format(", ".join(
+                "{} x{}".format(error, count)
+                for error, count in sorted(summary["errors"].items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--log", help="JSONL request log to replay")
+    parser.add_argument("--mix", type=parse_mix,
+                        default=parse_mix("read=80,write=15,search=5"),
+                        help="weights of generated read, write and search "
+                             "requests")
+    parser.add_argument("--requests", type=int,
+                        help="requests to send, by default 1000 or the "
+                             "whole log")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="client threads sending requests")
+    parser.add_argument("--rate", type=float,
+                        help="requests per second, by default as fast as "
+                             "the server answers")
+    parser.add_argument("--posts", type=int, default=10000,
+                        help="number of posts to seed")
+    parser.add_argument("--no-seed", action="store_true",
+                        help="use the posts already in the database")
+    parser.add_argument("--server", action="store_true",
+                        help="send requests over HTTP to a WSGI server")
+    parser.add_argument("--save", help="write results to a JSON file")
+    args = parser.parse_args()
+
+    if args.log:
+        requests = read_log(args.log)
+        if args.requests:
+            # Replay the log over and over until enough have been sent
+            requests = [requests[index % len(requests)]
+                        for index in range(args.requests)]
+    else:
+        requests = generate(args.requests or 1000, args.mix, args.posts)
+
+    if not args.no_seed:
+        seed(args.posts)
+
+    if args.server:
+        server = start_server()
+        make_sender = lambda: http_sender(server.server_port)
+    else:
+        make_sender = client_sender
+
+    results, elapsed = run(requests, args.concurrency, args.rate,
+                           make_sender)
+    summaries = {name: summarize(result, elapsed)
+                 for name, result in results.items()}
+    report(summaries)
+    print("\n{} requests in {:.1f}s".format(len(requests), elapsed))
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(summaries, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,37 @@ import os
 
 from flask import Flask
 
-app = Flask(__name__)
-config_path = os.environ.get("CONFIG_PATH", "posts.config.DevelopmentConfig")
-app.config.from_object(config_path)
 
-import api
+def create_app(config_path=None):
+    """
+    Build the app with the config object at config_path, by default the
+    one named by the CONFIG_PATH environment variable. The database isn't
+    touched until the first query; create the schema with init_db.
+    """
+    import api
+    import cache
+    import changes
+    import compression
+    import database
+    import instrumentation
+    import limits
+    import serializers
+    import writer
 
-from database import Base, engine
-Base.metadata.create_all(engine)
+    app = Flask(__name__)
+    app.config.from_object(config_path or os.environ.get(
+        "CONFIG_PATH", "posts.config.DevelopmentConfig"))
 
+    database.init_app(app)
+    limits.init_app(app)
+    cache.init_app(app)
+    serializers.init_app(app)
+    instrumentation.init_app(app)
+    compression.init_app(app)
+    writer.init_app(app)
+    changes.init_app(app)
+    app.register_blueprint(api.api)
+    return app
+
+
+app = create_app()
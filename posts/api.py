@@ -1,66 +1,492 @@
-import json
+import math
+import hashlib
 
-from flask import request, Response, url_for
-from jsonschema import validate, ValidationError
+from flask import Blueprint, current_app, request, Response, url_for
+from flask import stream_with_context
+from jsonschema import Draft4Validator, ValidationError
+from sqlalchemy import func
 
 import models
+import bulk
+import cache
+import changes
 import decorators
-from posts import app
+import search
+import serializers
+import writer
 from database import session
 
+api = Blueprint("api", __name__)
+
 
 # JSON Schema describing structure of a post
+# Lengths match the columns so oversized posts never reach the database
 post_schema = {
+    "type": "object",
     "properties": {
-        "title": {"type": "string"},
-        "body": {"type": "string"}
+        "title": {"type": "string",
+                  "maxLength": models.Post.__table__.c.title.type.length},
+        "body": {"type": "string",
+                 "maxLength": models.Post.__table__.c.body.type.length}
     },
     "required": ["title", "body"]
 }
 
+# Check the schema and build its validator once rather than per request
+Draft4Validator.check_schema(post_schema)
+post_validator = Draft4Validator(post_schema)
+
+# Fields of a post which can be picked with ?fields=
+post_fields = ("id", "title", "body")
+
+# Largest integer query arguments can hold, a signed 64 bit one
+MAX_INTEGER = 2 ** 63 - 1
+
+# List options which don't apply when looking posts up with ?ids=
+lookup_ignores = ("fields", "body_preview", "stream", "q", "title_like",
+                  "body_like", "after_id", "limit")
+
 
 
 
     
 # Returning all posts/or all with a query string in the title
 
-@app.route("/api/posts", methods=["GET"])
-@decorators.accept("application/json")
+@api.route("/api/posts", methods=["GET"])
+@decorators.rate_limit("read")
+@decorators.accept("application/json", "application/x-ndjson")
 def posts_get():
     """  Endpoint to retreive blog posts """
 
+    # Read the title and body filters from the query string
+    title_like = request.args.get("title_like")
+    body_like = request.args.get("body_like")
+
+    # Full text search terms, matched against the search index
+    q = request.args.get("q")
+
+    # Read the page size and cursor from the query string
+    # If not valid return 400 error
+    try:
+        limit, after_id = page_args()
+        fields, body_preview = field_args()
+    except ValueError as error:
+        data = serializers.dumps({"message": str(error)})
+        return Response(data, 400, mimetype="application/json")
+
+    # Look up the posts with the given ids
+    if "ids" in request.args:
+        try:
+            ids = id_args()
+        except ValueError as error:
+            data = serializers.dumps({"message": str(error)})
+            return Response(data, 400, mimetype="application/json")
+        if len(ids) > current_app.config["POSTS_MAX_PAGE_SIZE"]:
+            message = "At most {} posts can be looked up at once".format(
+                current_app.config["POSTS_MAX_PAGE_SIZE"])
+            data = serializers.dumps({"message": message})
+            return Response(data, 413, mimetype="application/json")
+
+        # Lookups send whole posts as cached, in one JSON array, so list
+        # options are refused rather than ignored
+        options = [name for name in lookup_ignores if name in request.args]
+        if options:
+            message = "{} can't be used with ids".format(", ".join(options))
+            data = serializers.dumps({"message": message})
+            return Response(data, 400, mimetype="application/json")
+        if "application/json" not in request.accept_mimetypes:
+            message = "Request must accept application/json data"
+            data = serializers.dumps({"message": message})
+            return Response(data, 406, mimetype="application/json")
+        return posts_by_ids(ids)
+
+    # Pass the query object to database and return a page of posts
+    # Only the needed columns are selected, no Post objects are built
+    posts = filter_posts(session.query(*post_columns(fields, body_preview)))
+
+    # Search mode returns the best ranked page of matching posts
+    # Ranked results have no id order to page through, so a cursor is
+    # refused rather than ignored
+    if q:
+        if after_id is not None:
+            message = "after_id can't be used with q, search returns " \
+                "only the best ranked page"
+            data = serializers.dumps({"message": message})
+            return Response(data, 400, mimetype="application/json")
+        posts = search.get_index().search(posts, q, limit)
+        return posts_response(posts, fields)
+
+    if after_id is not None:
+        posts = posts.filter(models.Post.id > after_id)
+
+    # Stream mode sends every matching post, reading them from the
+    # database in batches as the response is written
+    mimetype = request.accept_mimetypes.best_match(
+        ["application/json", "application/x-ndjson"])
+    stream = request.args.get("stream") in ("1", "true")
+    if stream or mimetype == "application/x-ndjson":
+        batch_size = current_app.config["POSTS_STREAM_BATCH_SIZE"]
+        posts = posts.order_by(models.Post.id). \
+            execution_options(stream_results=True).yield_per(batch_size)
+        chunks = stream_posts(posts, fields, batch_size,
+                              mimetype == "application/x-ndjson")
+        return Response(stream_with_context(chunks), 200, mimetype=mimetype)
+
+    # Fetch one extra row to find out whether there is a next page
+    posts = posts.order_by(models.Post.id).limit(limit + 1).all()
+
+    # Link to the next page, keyed on the last id of this page
+    headers = {}
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_url = url_for(".posts_get", limit=limit, after_id=posts[-1].id,
+                           title_like=title_like, body_like=body_like,
+                           fields=request.args.get("fields"),
+                           body_preview=body_preview, _external=True)
+        headers["Link"] = '<{}>; rel="next"'.format(next_url)
+
+    return posts_response(posts, fields, headers)
+
+
+def filter_posts(query):
+    """
+    Limit a query to live posts matching the title_like and body_like
+    filters in the query string
+    """
+    query = query.filter(models.Post.deleted_at == None)
+
     # Construct a query object from query string for title
     title_like = request.args.get("title_like")
+    if title_like:
+        query = query.filter(models.Post.title.contains(title_like))
 
     # Construct a query object from query string for body
     body_like = request.args.get("body_like")
-    
+    if body_like:
+        query = query.filter(models.Post.body.contains(body_like))
+    return query
+
+
+def posts_by_ids(ids):
+    """
+    Response with the posts with the given ids in the order asked for. Posts
+    in the post cache are served from it and the rest are read with one
+    query and cached, so the response is joined from the same JSON strings
+    GET /api/posts/<id> uses. Ids with no post are listed in X-Missing-Ids.
+    """
+    # Drop repeated ids, keeping the first of each
+    seen = set()
+    ids = [id for id in ids if not (id in seen or seen.add(id))]
+
+    found = {}
+    for id in ids:
+        cached = cache.post_cache.get(id)
+        if cached is not None:
+            found[id] = cached
+
+    uncached = [id for id in ids if id not in found]
+    if uncached:
+        posts = session.query(models.Post). \
+            filter(models.Post.id.in_(uncached)). \
+            filter(models.Post.deleted_at == None)
+        for post in posts:
+            found[post.id] = ("{}.{}".format(post.id, post.version),
+                              serializers.dumps(post.as_dictionary()))
+            cache.post_cache.set(post.id, found[post.id])
+
+    headers = {}
+    missing = [id for id in ids if id not in found]
+    if missing:
+        headers["X-Missing-Ids"] = ",".join(str(id) for id in missing)
+
+    # The ETag combines those of the posts
+    entries = [found[id] for id in ids if id in found]
+    key = ",".join(etag for etag, data in entries)
+    etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag, headers)
+
+    data = "[" + ",".join(data for etag, data in entries) + "]"
+    response = Response(data, 200, headers=headers,
+                        mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+
+def post_columns(fields=None, body_preview=None):
+    """
+    Columns to select for the requested fields of a post. The id and
+    version are always read as cursors and ETags are built from them. A
+    body preview is cut down by the database rather than after reading.
+    """
+    fields = fields or post_fields
+    columns = [models.Post.id, models.Post.version]
+    if "title" in fields:
+        columns.append(models.Post.title)
+    if "body" in fields:
+        if body_preview is None:
+            columns.append(models.Post.body)
+        else:
+            columns.append(func.substr(models.Post.body, 1, body_preview).
+                           label("body"))
+    return columns
+
+
+def posts_response(posts, fields=None, headers=None):
+    """
+    Response with a list of posts, or 304 Not Modified if the client
+    already has it. The ETag is built from the ids and versions of the
+    posts, the fields asked for and any Link header, so it is checked
+    before serializing.
+    """
+    headers = headers or {}
+    key = ",".join("{}.{}".format(post.id, post.version) for post in posts)
+    key += "|{}|{}|{}".format(fields, request.args.get("body_preview"),
+                              headers.get("Link", ""))
+    etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag, headers)
 
-    # Pass the query object to database and return all posts if available
-    posts = session.query(models.Post)
-    if title_like and body_like:
-        posts = posts.filter(models.Post.title.contains(title_like)). \
-                filter(models.Post.body.contains(body_like))
-        
-    elif title_like:
-        posts = posts.filter(models.Post.title.contains(title_like))
-        
-    elif body_like:
-        posts = posts.filter(models.Post.body.contains(body_like))
+    # Convert posts to JSON format and return response
+    data = serializers.dumps([serializers.post_dict(post, fields)
+                              for post in posts])
+    response = Response(data, 200, headers=headers,
+                        mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+
+def not_modified(etag, headers=None):
+    """ Empty 304 response telling the client its copy is current """
+    response = Response(status=304, headers=headers)
+    response.set_etag(etag)
+    return response
+
+
+def stream_posts(posts, fields, batch_size, ndjson=False):
+    """
+    Generator which serializes posts a batch at a time, as a JSON array or
+    as newline delimited JSON, so memory use doesn't grow with the result
+    """
+    batch = []
+    first = True
+    if not ndjson:
+        yield "["
+
+    for post in posts:
+        batch.append(serializers.dumps(serializers.post_dict(post, fields)))
+        if len(batch) == batch_size:
+            yield join_chunk(batch, first, ndjson)
+            batch = []
+            first = False
+
+    if batch:
+        yield join_chunk(batch, first, ndjson)
+    if not ndjson:
+        yield "]"
+
+
+def join_chunk(batch, first, ndjson):
+    """ Join a batch of serialized posts into one chunk of the stream """
+    if ndjson:
+        return "\n".join(batch) + "\n"
+    if first:
+        return ",".join(batch)
+    return "," + ",".join(batch)
+
+
+def page_args():
+    """
+    Read the limit and after_id cursor from the query string. The page size
+    is capped at POSTS_MAX_PAGE_SIZE so the cost of a list call is bounded
+    by the page size rather than the size of the table.
+    """
+    limit = request.args.get("limit", current_app.config["POSTS_PAGE_SIZE"])
+    after_id = request.args.get("after_id")
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    limit = min(limit, current_app.config["POSTS_MAX_PAGE_SIZE"])
+
+    if after_id is not None:
+        try:
+            after_id = int(after_id)
+        except ValueError:
+            raise ValueError("after_id must be an integer")
+        check_range("after_id", after_id)
+    return limit, after_id
+
+
+def check_range(name, value):
+    """
+    Refuse integers the database driver can't bind, which would otherwise
+    fail the query with an OverflowError
+    """
+    if not -MAX_INTEGER <= value <= MAX_INTEGER:
+        raise ValueError("{} is out of range".format(name))
+
+
+def id_args():
+    """ Read a comma separated list of post ids from the query string """
+    try:
+        ids = [int(id) for id in request.args.get("ids", "").split(",")]
+    except ValueError:
+        raise ValueError("ids must be a comma separated list of integers")
+    for id in ids:
+        check_range("ids", id)
+    return ids
+
+
+def field_args():
+    """
+    Read the fields and body_preview options from the query string, so
+    list consumers only pay for the columns they use
+    """
+    fields = request.args.get("fields")
+    if fields is not None:
+        fields = tuple(field.strip() for field in fields.split(","))
+        for field in fields:
+            if field not in post_fields:
+                raise ValueError("Unknown field {}".format(field))
+
+    body_preview = request.args.get("body_preview")
+    if body_preview is not None:
+        try:
+            body_preview = int(body_preview)
+        except ValueError:
+            raise ValueError("body_preview must be an integer")
+        if body_preview < 0:
+            raise ValueError("body_preview must not be negative")
+    return fields, body_preview
+
+
+# Counting posts, with the same filters as listing them
+
+@api.route("/api/posts/count", methods=["GET"])
+@decorators.rate_limit("read")
+@decorators.accept("application/json")
+def posts_count_get():
+    """  Endpoint to count blog posts """
+
+    # Without filters a maintained counter answers without a scan
+    count = None
+    filtered = request.args.get("title_like") or \
+        request.args.get("body_like")
+    if current_app.config["POST_COUNTER"] and not filtered:
+        count = session.query(models.PostCounter.value). \
+            filter(models.PostCounter.name == "posts").scalar()
+
+    # Else let the database count them, no rows are returned
+    if count is None:
+        count = filter_posts(session.query(func.count(models.Post.id))). \
+            scalar()
+
+    data = serializers.dumps({"count": count})
+    return Response(data, 200, mimetype="application/json")
 
-    else:
-        posts = posts.all()
 
-    # Convert posts to JSON format and return response
-    data = json.dumps([post.as_dictionary() for post in posts])
+@api.route("/api/posts/stats", methods=["GET"])
+@decorators.rate_limit("read")
+@decorators.accept("application/json")
+def posts_stats_get():
+    """  Endpoint for the number of posts and their body lengths """
+
+    # All the aggregates come from one query
+    length = func.length(models.Post.body)
+    count, shortest, longest, average = filter_posts(session.query(
+        func.count(models.Post.id), func.min(length), func.max(length),
+        func.avg(length))).one()
+
+    data = serializers.dumps({
+        "count": count,
+        "body_length": {
+            "min": shortest,
+            "max": longest,
+            "avg": float(average) if average is not None else None
+        }
+    })
     return Response(data, 200, mimetype="application/json")
 
 
+# Returning the posts created and deleted since a point in the change log
+
+@api.route("/api/posts/changes", methods=["GET"])
+@decorators.rate_limit("read")
+@decorators.accept("application/json")
+def posts_changes_get():
+    """  Endpoint to follow changes to the posts """
+
+    # Read the sequence number to start after, the page size and how long
+    # to wait for changes from the query string
+    # If not valid return 400 error
+    try:
+        since, limit, wait = change_args()
+    except ValueError as error:
+        data = serializers.dumps({"message": str(error)})
+        return Response(data, 400, mimetype="application/json")
+
+    # Each waiting request ties up a server thread, so only a few may wait
+    # at once and the rest are asked to come back
+    waiters = current_app.extensions["posts.change_waiters"]
+    if wait and not waiters.acquire(current_app.config["CHANGES_MAX_WAITERS"]):
+        retry_after = int(math.ceil(
+            current_app.config["CHANGES_POLL_INTERVAL"]))
+        data = serializers.dumps({"message": "Too many requests waiting "
+                                              "for changes"})
+        return Response(data, 503, mimetype="application/json",
+                        headers={"Retry-After": str(retry_after)})
+
+    # Clients pass last_seq back as since to get the next changes
+    try:
+        entries = changes.wait_for_changes(
+            session, since, limit, wait,
+            current_app.config["CHANGES_POLL_INTERVAL"])
+    finally:
+        if wait:
+            waiters.release()
+    last_seq = entries[-1].seq if entries else since
+    data = serializers.dumps({
+        "changes": [entry.as_dictionary() for entry in entries],
+        "last_seq": last_seq
+    })
+    return Response(data, 200, mimetype="application/json")
+
+
+def change_args():
+    """
+    Read the since, limit and wait arguments for the change feed. The page
+    size is capped at CHANGES_MAX_PAGE_SIZE and the wait at
+    CHANGES_MAX_WAIT seconds.
+    """
+    config = current_app.config
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        raise ValueError("since must be an integer")
+    check_range("since", since)
+    try:
+        limit = int(request.args.get("limit", config["CHANGES_PAGE_SIZE"]))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        raise ValueError("wait must be a number")
+    return (since, min(limit, config["CHANGES_MAX_PAGE_SIZE"]),
+            max(0, min(wait, config["CHANGES_MAX_WAIT"])))
+
+
 # Posting a blog post to the database
 
-@app.route("/api/posts", methods=["POST"])
+@api.route("/api/posts", methods=["POST"])
+@decorators.rate_limit("write")
 @decorators.accept("application/json")
-@decorators.require("application/json")
+@decorators.require("application/json", max_length="MAX_POST_LENGTH")
 def posts_put():
     """  Endpoint to post blog posts """
 
@@ -70,74 +496,192 @@ def posts_put():
     # First validate data object is valid JSON
     # If not valid return 422 error
     try:
-        validate(data, post_schema)
+        post_validator.validate(data)
     except ValidationError as error:
-        data = {"message": error.message}
-        return Response(json.dumps(data), 422, mimetype="application/json")        
-
-    
-    # Create data object from the request 
-    data = request.json
+        data = serializers.dumps({"message": error.message})
+        return Response(data, 422, mimetype="application/json")
 
     # Post data object to database
-    post = models.Post(title=data["title"], body=data["body"])
-    session.add(post)
-    session.commit()
+    if current_app.config["GROUP_COMMIT"]:
+        # Committed together with posts from other requests
+        row = {"title": data["title"], "body": data["body"]}
+        try:
+            post = dict(row, id=writer.writer.submit(row))
+        except writer.WriteTimeout as error:
+            # The writer is behind and may still write the post later
+            # If so return 503 error
+            retry_after = int(math.ceil(
+                current_app.config["GROUP_COMMIT_TIMEOUT"]))
+            data = serializers.dumps({"message": str(error)})
+            return Response(data, 503, mimetype="application/json",
+                            headers={"Retry-After": str(retry_after)})
+    else:
+        post = models.Post(title=data["title"], body=data["body"])
+        session.add(post)
+
+        # Index the post in the same transaction so searches never miss it
+        session.flush()
+        search.get_index().add(session, [post.as_dictionary()])
+        bulk.record_changes(session, "create", [post.id])
+        session.commit()
+        cache.post_cache.delete(post.id)
+        post = post.as_dictionary()
 
     # Response to client of successful post
-    data = json.dumps(post.as_dictionary())
-    headers = {"Location": url_for("post_get", id=post.id)}
+    data = serializers.dumps(post)
+    headers = {"Location": url_for(".post_get", id=post["id"])}
     return Response(data, 201, headers=headers,
                     mimetype="application/json")
 
  
 
+# Posting many blog posts in one request
+
+@api.route("/api/posts/bulk", methods=["POST"])
+@decorators.rate_limit("write")
+@decorators.accept("application/json")
+@decorators.require("application/json", "application/x-ndjson",
+                    max_length="MAX_BULK_LENGTH")
+def posts_bulk_put():
+    """  Endpoint to post many blog posts at once """
+
+    # Read the posts from a JSON array or NDJSON body
+    # If the body can't be read return 400 error
+    try:
+        items = bulk.read_items(request)
+    except ValueError as error:
+        data = serializers.dumps({"message": str(error)})
+        return Response(data, 400, mimetype="application/json")
+
+    if len(items) > current_app.config["BULK_MAX_ITEMS"]:
+        message = "At most {} posts can be posted at once".format(
+            current_app.config["BULK_MAX_ITEMS"])
+        data = serializers.dumps({"message": message})
+        return Response(data, 413, mimetype="application/json")
+
+    # Validate every post before writing any of them
+    # If any are invalid return 422 error listing each one
+    errors = []
+    for index, item in enumerate(items):
+        if isinstance(item, ValueError):
+            errors.append({"index": index, "message": str(item)})
+            continue
+        try:
+            post_validator.validate(item)
+        except ValidationError as error:
+            errors.append({"index": index, "message": error.message})
+    if errors:
+        data = {"message": "Invalid posts", "errors": errors}
+        return Response(serializers.dumps(data), 422,
+                        mimetype="application/json")
+
+    # Insert all the posts in a single transaction
+    rows = [{"title": item["title"], "body": item["body"]} for item in items]
+    ids = bulk.insert_posts(session, rows)
+    session.commit()
+    for id in ids:
+        cache.post_cache.delete(id)
+
+    data = serializers.dumps({"ids": ids})
+    return Response(data, 201, mimetype="application/json")
+
+
+
 # Returning a single post
     
-@app.route("/api/posts/<int:id>", methods=["GET"])
+@api.route("/api/posts/<int:id>", methods=["GET"])
+@decorators.rate_limit("read")
 @decorators.accept("application/json")
 def post_get(id):
     """  Single post endpoint """
 
-    # Get post with <id> from database
-    post = session.query(models.Post).get(id)
+    # Serve the post from the cache if it's there
+    cached = cache.post_cache.get(id)
+    if cached is not None:
+        etag, data = cached
+    else:
+        # Get post with <id> from database
+        post = session.query(models.Post).get(id)
 
 
-    # Check if post exists
-    # If not return 404 with a helpful message
-    if not post:
-        message = "Could not find post with id {}".format(id)
-        data = json.dumps({"message": message})
-        return Response(data, 404, mimetype="application/json")
+        # Check if post exists and hasn't been soft deleted
+        # If not return 404 with a helpful message
+        if not post or post.deleted_at is not None:
+            message = "Could not find post with id {}".format(id)
+            data = serializers.dumps({"message": message})
+            return Response(data, 404, mimetype="application/json")
+
+        # Else cache the post with its ETag
+        etag = "{}.{}".format(post.id, post.version)
+        data = serializers.dumps(post.as_dictionary())
+        cache.post_cache.set(id, (etag, data))
+
+    # Return 304 if the client has the current version, else the post
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    response = Response(data, 200, mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+
+
+# Deleting many posts
 
-    # Else return post
-    data = json.dumps(post.as_dictionary())
+@api.route("/api/posts", methods=["DELETE"])
+@decorators.rate_limit("write")
+@decorators.accept("application/json")
+def posts_delete():
+    """  Endpoint to delete many posts at once """
+
+    # Read the comma separated ids from the query string
+    # If not valid return 400 error
+    try:
+        ids = id_args()
+    except ValueError as error:
+        data = serializers.dumps({"message": str(error)})
+        return Response(data, 400, mimetype="application/json")
+
+    if len(ids) > current_app.config["BULK_DELETE_MAX_IDS"]:
+        message = "At most {} posts can be deleted at once".format(
+            current_app.config["BULK_DELETE_MAX_IDS"])
+        data = serializers.dumps({"message": message})
+        return Response(data, 413, mimetype="application/json")
+
+    # Delete the posts with one statement, without loading them
+    deleted = bulk.delete_posts(session, ids,
+                                soft=current_app.config["SOFT_DELETE"])
+    session.commit()
+    for id in ids:
+        cache.post_cache.delete(id)
+
+    data = serializers.dumps({"deleted": len(deleted)})
     return Response(data, 200, mimetype="application/json")
 
 
 
 # Deleting a single post
 
-@app.route("/api/post/<int:id>", methods=["DELETE"])
+@api.route("/api/post/<int:id>", methods=["DELETE"])
+@decorators.rate_limit("write")
 @decorators.accept("application/json")
 def post_delete(id):
     """  Delete single post endpoint """
 
-    # Get post from database if exits
-    post = session.query(models.Post).get(id)
-    
-    # Check if post exists
+    # Delete post with <id> from database and the search index
+    deleted = bulk.delete_posts(session, [id],
+                                soft=current_app.config["SOFT_DELETE"])
+
+    # Check if post existed
     # If not return 404 with a helpful message
-    if not post:
+    if not deleted:
         message = "Could not find post with id {}".format(id)
-        data = json.dumps({"message": message})
+        data = serializers.dumps({"message": message})
         return Response(data, 404, mimetype="application/json")
 
-    # Delete post with <id> from database
-    session.delete(post)
     session.commit()
+    cache.post_cache.delete(id)
         
     # Confirm post deleted
     message = "Deleted post with id {} from the database".format(id)
-    data = json.dumps({"message": message})
-    return Response(data, 200, mimetype="application/json")
\ No newline at end of file
+    data = serializers.dumps({"message": message})
+    return Response(data, 200, mimetype="application/json")
@@ -0,0 +1,164 @@
+import datetime
+
+import models
+import search
+import serializers
+from flask import current_app
+from sqlalchemy import func
+
+
+
+def read_items(request):
+    """
+    Read the posts from a bulk request body, either a JSON array or NDJSON
+    with one post per line. Lines which are not valid JSON are returned as
+    ValueErrors in place of their item so they can be reported per item.
+    """
+    data = request.get_data()
+    if request.mimetype == "application/x-ndjson":
+        items = []
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(serializers.loads(line))
+            except ValueError:
+                items.append(ValueError("Invalid JSON"))
+        return items
+
+    try:
+        items = serializers.loads(data)
+    except ValueError:
+        raise ValueError("Request body must be valid JSON")
+    if not isinstance(items, list):
+        raise ValueError("Request body must be a JSON array of posts")
+    return items
+
+
+def insert_posts(session, rows):
+    """
+    Insert post rows (dicts of title and body) without building ORM objects,
+    index and log them, and return their new ids in order. Databases which
+    support it get one multi-row INSERT ... RETURNING per chunk, others a
+    statement per row. Nothing is committed so the caller decides the
+    transaction.
+    """
+    table = models.Post.__table__
+    dialect = session.get_bind().dialect
+    chunk_size = current_app.config["BULK_INSERT_CHUNK_SIZE"]
+
+    ids = []
+    if dialect.implicit_returning and dialect.supports_multivalues_insert:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            result = session.execute(
+                table.insert().values(chunk).returning(table.c.id))
+            ids.extend(row[0] for row in result)
+    else:
+        for row in rows:
+            result = session.execute(table.insert(), row)
+            ids.append(result.inserted_primary_key[0])
+
+    search.get_index().add(session, [dict(row, id=id)
+                                     for row, id in zip(rows, ids)])
+    record_changes(session, "create", ids)
+    return ids
+
+
+def delete_posts(session, ids, soft=False):
+    """
+    Delete the live posts with the given ids in a single statement without
+    loading them, drop them from the search index and log their deletion.
+    Soft deletes only set deleted_at, leaving the rows for purge_deleted.
+    Returns the ids of the posts deleted; nothing is committed.
+    """
+    table = models.Post.__table__
+    if not ids:
+        return []
+
+    condition = table.c.id.in_(ids) & (table.c.deleted_at == None)
+    if soft:
+        statement = table.update().values(
+            deleted_at=datetime.datetime.utcnow())
+    else:
+        statement = table.delete()
+
+    # Databases which support it say which rows went with RETURNING,
+    # others have them selected first
+    if session.get_bind().dialect.implicit_returning:
+        result = session.execute(
+            statement.where(condition).returning(table.c.id))
+        deleted = [row[0] for row in result]
+    else:
+        deleted = [row[0] for row in session.execute(
+            table.select().with_only_columns([table.c.id]).where(condition))]
+        if deleted:
+            session.execute(statement.where(table.c.id.in_(deleted)))
+
+    if deleted:
+        search.get_index().remove(session, deleted)
+        record_changes(session, "delete", deleted)
+    return deleted
+
+
+def record_changes(session, op, ids):
+    """
+    Log that the posts with the given ids were created or deleted, and
+    keep the post counter in step if there is one, in the caller's
+    transaction so neither ever disagrees with the posts
+    """
+    if not ids:
+        return
+    # Entries note their transaction so readers can tell which ones are
+    # settled, see changes.read_changes
+    insert = models.PostChange.__table__.insert()
+    if session.get_bind().dialect.name == "postgresql":
+        insert = insert.values(txid=func.txid_current())
+    session.execute(insert, [{"post_id": id, "op": op} for id in ids])
+
+    if current_app.config["POST_COUNTER"]:
+        counter = models.PostCounter.__table__
+        delta = len(ids) if op == "create" else -len(ids)
+        session.execute(counter.update().
+                        where(counter.c.name == "posts").
+                        values(value=counter.c.value + delta))
+
+
+def recount_posts(session):
+    """
+    Set the post counter to the number of live posts, e.g. after turning
+    POST_COUNTER on. Nothing is committed.
+    """
+    counter = models.PostCounter.__table__
+    count = session.query(func.count(models.Post.id)). \
+        filter(models.Post.deleted_at == None).scalar()
+    session.execute(counter.delete().where(counter.c.name == "posts"))
+    session.execute(counter.insert().values(name="posts", value=count))
+    return count
+
+
+def purge_deleted(session, batch_size, older_than=0):
+    """
+    Remove soft deleted posts which were deleted at least older_than
+    seconds ago, committing every batch_size rows so no transaction holds
+    its locks for long. Returns the number of posts removed.
+    """
+    table = models.Post.__table__
+    cutoff = datetime.datetime.utcnow() - \
+        datetime.timedelta(seconds=older_than)
+
+    purged = 0
+    while True:
+        ids = [row[0] for row in session.execute(
+            table.select().
+            with_only_columns([table.c.id]).
+            where(table.c.deleted_at <= cutoff).
+            order_by(table.c.deleted_at).
+            limit(batch_size))]
+        if not ids:
+            return purged
+        # Their search terms and change log entries went when they were
+        # soft deleted
+        session.execute(table.delete().where(table.c.id.in_(ids)))
+        session.commit()
+        purged += len(ids)
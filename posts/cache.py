@@ -0,0 +1,91 @@
+import time
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+from werkzeug.utils import import_string
+
+
+class CacheBackend(object):
+    """
+    Interface for the post cache. A shared store such as Redis can be used
+    by implementing get, set, delete and clear on top of it and setting
+    POST_CACHE_BACKEND to the dotted path of the class.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class LRUCache(CacheBackend):
+    """
+    In process cache holding at most maxsize entries, each kept for ttl
+    seconds. The least recently used entry is dropped when it is full.
+    """
+    def __init__(self, maxsize=1024, ttl=60):
+        super(LRUCache, self).__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            # Re-insert to mark the entry as most recently used
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def create_cache(config):
+    """ Build the cache backend named in the config """
+    backend = import_string(config["POST_CACHE_BACKEND"])
+    return backend(maxsize=config["POST_CACHE_SIZE"],
+                   ttl=config["POST_CACHE_TTL"])
+
+
+def init_app(app):
+    """ Create the post cache from the app config """
+    app.extensions["posts.cache"] = create_cache(app.config)
+
+
+# ETag and serialized JSON of single posts keyed by post id, for the
+# current app
+post_cache = LocalProxy(lambda: current_app.extensions["posts.cache"])
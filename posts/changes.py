@@ -0,0 +1,89 @@
+import time
+import threading
+
+from sqlalchemy import event, func, tuple_
+
+import models
+from database import RoutingSession
+
+
+# Notified whenever a session in this process commits, so long polls wake
+# as soon as a local write lands
+committed = threading.Condition()
+
+
+def notify(session):
+    with committed:
+        committed.notify_all()
+
+event.listen(RoutingSession, "after_commit", notify)
+
+
+def read_changes(session, since, limit):
+    """
+    The first limit changes after the entry with sequence number since.
+
+    Sequence numbers are handed out as entries are inserted, not as their
+    transactions commit, so on Postgres a reader could see seq 6 before
+    seq 5 commits and skip it. Entries are read in the order of the
+    transactions which wrote them instead, and only once every transaction
+    older than theirs has finished, so no entry can turn up before one
+    already read. A transaction left open holds the feed back until it
+    ends. SQLite runs one write transaction at a time, so its sequence
+    numbers are already in commit order.
+    """
+    entries = session.query(models.PostChange)
+    if session.get_bind().dialect.name != "postgresql":
+        return entries.filter(models.PostChange.seq > since). \
+            order_by(models.PostChange.seq).limit(limit).all()
+
+    txid = session.query(models.PostChange.txid). \
+        filter(models.PostChange.seq == since).scalar() or 0
+    horizon = func.txid_snapshot_xmin(func.txid_current_snapshot())
+    return entries.filter(models.PostChange.txid < horizon). \
+        filter(tuple_(models.PostChange.txid, models.PostChange.seq) >
+               tuple_(txid, since)). \
+        order_by(models.PostChange.txid, models.PostChange.seq). \
+        limit(limit).all()
+
+
+class Waiters(object):
+    """ Count of the requests waiting for changes in a process """
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, limit):
+        """ Count one more waiting request, unless limit already are """
+        with self.lock:
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.count -= 1
+
+
+def wait_for_changes(session, since, limit, timeout, poll_interval):
+    """
+    Read the changes after since, waiting up to timeout seconds for some
+    to be written if there are none yet. The session is closed between
+    reads so a waiting request doesn't hold a pooled connection. Writes
+    from other processes are picked up every poll_interval seconds.
+    """
+    deadline = time.time() + timeout
+    while True:
+        changes = read_changes(session, since, limit)
+        remaining = deadline - time.time()
+        if changes or remaining <= 0:
+            return changes
+        session.close()
+        with committed:
+            committed.wait(min(remaining, poll_interval))
+
+
+def init_app(app):
+    """ Count the requests waiting for changes in each process """
+    app.extensions["posts.change_waiters"] = Waiters()
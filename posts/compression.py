@@ -0,0 +1,82 @@
+import zlib
+
+from flask import request
+
+from cache import LRUCache
+
+# Brotli and Zstandard are optional, gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def gzip_compress(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+compressors = {"gzip": gzip_compress}
+if brotli:
+    compressors["br"] = lambda data, level: brotli.compress(data,
+                                                            quality=level)
+if zstandard:
+    compressors["zstd"] = lambda data, level: zstandard.ZstdCompressor(
+        level=level).compress(data)
+
+
+class Compressor(object):
+    """
+    Compresses responses with the best encoding both the client and the
+    server support. Compressed bodies of responses with an ETag are kept
+    in an LRU cache keyed by encoding and ETag, so hot responses are only
+    compressed once.
+    """
+    def __init__(self, config):
+        self.encodings = [encoding for encoding
+                          in config["COMPRESSION_ENCODINGS"]
+                          if encoding in compressors]
+        self.levels = config["COMPRESSION_LEVELS"]
+        self.min_size = config["COMPRESSION_MIN_SIZE"]
+        self.cache = LRUCache(maxsize=config["COMPRESSION_CACHE_SIZE"],
+                              ttl=config["POST_CACHE_TTL"])
+
+    def __call__(self, response):
+        if response.status_code != 200 or response.direct_passthrough or \
+                response.is_streamed or "Content-Encoding" in response.headers:
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None or not request.accept_encodings[encoding]:
+            return response
+
+        etag, weak = response.get_etag()
+        body = self.cache.get((encoding, etag)) if etag else None
+        if body is None:
+            body = compressors[encoding](data, self.levels[encoding])
+            if etag:
+                self.cache.set((encoding, etag), body)
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        # The compressed body is only semantically the same as the original
+        # one, so the ETag becomes weak like it does behind most proxies
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def init_app(app):
+    """ Compress responses if the app config asks for it """
+    if app.config["COMPRESSION"]:
+        app.after_request(Compressor(app.config))
@@ -1,10 +1,277 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import time
+import itertools
+import threading
+
+from flask import current_app, request, has_request_context
+from sqlalchemy import create_engine, event, exc, inspect, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 
-from posts import app
 
-engine = create_engine(app.config["DATABASE_URI"])
+def engine_options(uri, config):
+    """ Connection pool arguments for create_engine from the app config """
+    # SQLite uses its own single connection pools which take no sizing
+    if make_url(uri).drivername.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": config["DATABASE_POOL_SIZE"],
+        "max_overflow": config["DATABASE_MAX_OVERFLOW"],
+        "pool_recycle": config["DATABASE_POOL_RECYCLE"]
+    }
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """
+    Check a pooled connection is still alive as it is checked out. Raising
+    DisconnectionError makes the pool throw it away and try a fresh one.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+def build_engine(uri, config):
+    """ Engine for a database with the pool settings from the config """
+    engine = create_engine(uri, **engine_options(uri, config))
+    if config["DATABASE_POOL_PRE_PING"]:
+        event.listen(engine.pool, "checkout", ping_connection)
+    return engine
+
+
+class ReplicaPool(object):
+    """
+    Hands out read replica engines in turn. A replica is checked with a
+    SELECT 1 at most once per interval, and one which fails is skipped
+    until the interval has passed. With no healthy replica choose returns
+    None and reads fall back to the primary.
+    """
+    def __init__(self, engines, interval):
+        self.engines = engines
+        self.interval = interval
+        self.turns = itertools.cycle(engines)
+        self.checked = {}
+        self.down_until = {}
+        self.lock = threading.Lock()
+
+    def choose(self):
+        for _ in range(len(self.engines)):
+            with self.lock:
+                engine = next(self.turns)
+            if self.healthy(engine):
+                return engine
+        return None
+
+    def healthy(self, engine):
+        now = time.time()
+        if self.down_until.get(engine, 0) > now:
+            return False
+        if self.checked.get(engine, 0) + self.interval > now:
+            return True
+        try:
+            connection = engine.connect()
+            try:
+                connection.execute(select([1]))
+            finally:
+                connection.close()
+        except exc.DBAPIError:
+            self.down_until[engine] = now + self.interval
+            return False
+        self.checked[engine] = now
+        return True
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+
+class Database(object):
+    """
+    The engines of one app. They are only created when first used, so
+    building the app never touches the database.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.engine = None
+        self.replicas = None
+        self.lock = threading.Lock()
+
+    def get_engine(self):
+        if self.engine is None:
+            with self.lock:
+                if self.engine is None:
+                    self.engine = build_engine(self.config["DATABASE_URI"],
+                                               self.config)
+        return self.engine
+
+    def get_replicas(self):
+        if self.replicas is None:
+            with self.lock:
+                if self.replicas is None:
+                    self.replicas = ReplicaPool(
+                        [build_engine(uri, self.config)
+                         for uri in self.config["DATABASE_REPLICA_URIS"]],
+                        self.config["REPLICA_HEALTH_CHECK_INTERVAL"])
+        return self.replicas
+
+    def dispose(self):
+        if self.engine is not None:
+            self.engine.dispose()
+        if self.replicas is not None:
+            self.replicas.dispose()
+
+
+# Cookie holding the time until which a client that wrote reads from the
+# primary, so it sees its own writes despite replication lag
+STICKY_COOKIE = "posts_primary_until"
+
+
+def init_app(app):
+    """
+    Use the app's database settings, end sessions with requests and keep
+    clients which write on the primary for a while
+    """
+    if "posts.database" in app.extensions:
+        app.extensions["posts.database"].dispose()
+    app.extensions["posts.database"] = Database(app.config)
+    app.teardown_request(remove_session)
+    app.teardown_appcontext(remove_session)
+    app.after_request(stick_to_primary)
+
+
+def get_database(app=None):
+    """ The engines of the given app, by default the current one """
+    return (app or current_app).extensions["posts.database"]
+
+
+def get_engine(app=None):
+    """ The engine for the primary database, created on first use """
+    return get_database(app).get_engine()
+
+
+def get_replicas(app=None):
+    """ The pool of read replica engines, created on first use """
+    return get_database(app).get_replicas()
+
+
+def dispose(app=None):
+    """ Close the engines' pooled connections, e.g. after forking """
+    get_database(app).dispose()
+
+
+def read_engine():
+    """
+    Engine for the reads of the current request: a replica for GET
+    requests from clients which haven't written recently, else the
+    primary. The choice is kept for the rest of the request.
+    """
+    if not (has_request_context() and
+            current_app.config["DATABASE_REPLICA_URIS"]):
+        return get_engine()
+    if "posts.read_engine" not in request.environ:
+        engine = None
+        primary_until = request.cookies.get(STICKY_COOKIE, type=float)
+        if request.method in ("GET", "HEAD") and \
+                (primary_until or 0) < time.time():
+            engine = get_replicas().choose()
+        request.environ["posts.read_engine"] = engine or get_engine()
+    return request.environ["posts.read_engine"]
+
+
+def stick_to_primary(response):
+    """ After a successful write send the client's reads to the primary """
+    window = current_app.config["READ_YOUR_WRITES_SECONDS"]
+    if current_app.config["DATABASE_REPLICA_URIS"] and window and \
+            request.method not in ("GET", "HEAD") and \
+            response.status_code < 400:
+        response.set_cookie(STICKY_COOKIE, str(time.time() + window),
+                            max_age=window)
+    return response
+
+
+class RoutingSession(Session):
+    """
+    Session which sends writes to the primary and reads to the engine
+    picked by read_engine
+    """
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing:
+            return get_engine()
+        return read_engine()
+
+
 Base = declarative_base()
-Session = sessionmaker(bind=engine)
-session = Session()
+
+# One session per thread, handed back to the pool when the request ends
+session = scoped_session(sessionmaker(class_=RoutingSession))
+
+
+def remove_session(exception=None):
+    session.remove()
+
+
+def init_db(app=None):
+    """
+    Create the tables and indexes. Run once per deployment with
+    "python run.py initdb" rather than by every process that starts.
+    """
+    # Importing these registers their tables and indexes on the metadata
+    import models  # noqa
+    import search  # noqa
+    Base.metadata.create_all(get_engine(app))
+
+
+def upgrade_db(app=None):
+    """
+    Bring a database made by an older release up to date. create_all only
+    adds missing tables, so the columns and indexes since added to the
+    posts and post_changes tables are added here. Safe to run on every
+    deployment.
+    """
+    import models
+    import search
+    engine = get_engine(app)
+    init_db(app)
+
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in [models.Post.__table__, models.PostChange.__table__]:
+            columns = set(column["name"]
+                          for column in inspector.get_columns(table.name))
+            missing = [column for column in table.columns
+                       if column.name not in columns]
+            # SQLite can't add a column whose default is an expression
+            # such as now(), recreate development databases instead
+            computed = [column.name for column in missing
+                        if column.server_default is not None and
+                        not isinstance(column.server_default.arg,
+                                       basestring)]
+            if computed and engine.dialect.name != "postgresql":
+                raise RuntimeError("Adding columns {} needs Postgres".format(
+                    ", ".join(computed)))
+            for column in missing:
+                connection.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                    table.name,
+                    CreateColumn(column).compile(dialect=engine.dialect)))
+
+            indexes = set(index["name"]
+                          for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+
+        # The title_like filter matches anywhere in the title, so the
+        # plain title index older releases made was never used
+        connection.execute("DROP INDEX IF EXISTS ix_posts_title")
+
+        # Expression indexes aren't reflected, these create them only if
+        # they don't exist yet
+        if engine.dialect.name == "postgresql":
+            connection.execute(models.pg_trgm)
+            for ddl in models.trigram_indexes + [search.search_index]:
+                connection.execute(ddl)
@@ -1,19 +1,26 @@
 import json
+import math
+from io import BytesIO
 from functools import wraps
 
-from flask import request, Response
+from flask import current_app, request, Response
+from werkzeug.wsgi import get_input_stream
 
-def accept(mimetype):
+import limits
+
+def accept(*mimetypes):
     def decorator(func):
         """
         Decorator which returns a 406 Not Acceptable if the client wont't
-        accept a certain mimetype
+        accept any of the given mimetypes
         """
         @wraps(func)
         def wrapper(*args, **kwargs):
-            if mimetype in request.accept_mimetypes:
-                return func(*args, **kwargs)
-            message = "Request must accept {} data".format(mimetype)
+            for mimetype in mimetypes:
+                if mimetype in request.accept_mimetypes:
+                    return func(*args, **kwargs)
+            message = "Request must accept {} data".format(
+                " or ".join(mimetypes))
             data = json.dumps({"message": message})
             return Response(data, 406, mimetype="application/json")
         return wrapper
@@ -21,18 +28,88 @@ def accept(mimetype):
 
 
 
-def require(mimetype):
+def buffer_body(limit):
+    """
+    Read a body sent without a Content-Length, as chunked requests are,
+    into memory and make it the request's body. Reading stops after limit
+    bytes, returning False if there was more.
+    """
+    stream = get_input_stream(request.environ)
+    chunks = []
+    size = 0
+    while size <= limit:
+        chunk = stream.read(limit + 1 - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    if size > limit:
+        return False
+
+    # The body now has a known length, so the request reads it as usual
+    data = b"".join(chunks)
+    request.environ["wsgi.input"] = BytesIO(data)
+    request.environ["CONTENT_LENGTH"] = str(len(data))
+    request.environ.pop("wsgi.input_terminated", None)
+    return True
+
+
+def require(*mimetypes, **options):
     def decorator(func):
         """
         Decorator which returns a 415 Unsupported Media if the client is
-        posting non-json media
+        posting media other than one of the given mimetypes, or a 413
+        Request Entity Too Large if the body is longer than the config
+        setting named by max_length. Bodies with a Content-Length are
+        checked before being read, chunked ones while being read.
         """
         @wraps(func)
         def wrapper(*args, **kwargs):
-            if (request.mimetype == mimetype):
+            if options.get("max_length"):
+                limit = current_app.config[options["max_length"]]
+                if request.content_length is None:
+                    too_large = not buffer_body(limit)
+                else:
+                    too_large = request.content_length > limit
+                if too_large:
+                    message = "Request body must be at most {} bytes".format(
+                        limit)
+                    data = json.dumps({"message": message})
+                    return Response(data, 413, mimetype="application/json")
+            if (request.mimetype in mimetypes):
                 return func(*args, **kwargs)
-            message = "Request must contain {} data".format(mimetype)
+            message = "Request must contain {} data".format(
+                " or ".join(mimetypes))
             data = json.dumps({"message": message})
             return Response(data, 415, mimetype="application/json")
         return wrapper
     return decorator
+
+
+def rate_limit(scope):
+    def decorator(func):
+        """
+        Decorator which returns a 429 Too Many Requests if the client has
+        used up its token bucket for the scope, with the rate and burst
+        set in RATE_LIMITS. Clients are told in Retry-After when to try
+        again.
+        """
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not current_app.config["RATE_LIMIT"]:
+                return func(*args, **kwargs)
+            rate, burst = current_app.config["RATE_LIMITS"][scope]
+            header = current_app.config["RATE_LIMIT_KEY_HEADER"]
+            client = (header and request.headers.get(header)) or \
+                request.remote_addr
+            wait = limits.limiter.take((scope, client), rate, burst)
+            if not wait:
+                return func(*args, **kwargs)
+            retry_after = int(math.ceil(wait))
+            message = "Rate limit exceeded, retry in {} seconds".format(
+                retry_after)
+            data = json.dumps({"message": message})
+            return Response(data, 429, mimetype="application/json",
+                            headers={"Retry-After": str(retry_after)})
+        return wrapper
+    return decorator
@@ -0,0 +1,167 @@
+import time
+import threading
+from functools import wraps
+
+from flask import current_app, g, request, Response, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import cache
+
+
+# Upper bounds in seconds of the request duration histogram buckets
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+
+class Metrics(object):
+    """
+    Request counts and timings for each endpoint, kept in process and
+    rendered in the Prometheus text format
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, status, timings):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                "requests": 0, "errors": 0, "seconds": 0.0,
+                "buckets": [0] * len(BUCKETS), "queries": 0,
+                "db_seconds": 0.0, "serialize_seconds": 0.0
+            })
+            stats["requests"] += 1
+            if status >= 500:
+                stats["errors"] += 1
+            stats["seconds"] += timings["app"]
+            for index, bound in enumerate(BUCKETS):
+                if timings["app"] <= bound:
+                    stats["buckets"][index] += 1
+            stats["queries"] += timings["queries"]
+            stats["db_seconds"] += timings["db"]
+            stats["serialize_seconds"] += timings["serialize"]
+
+    def render(self):
+        lines = []
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+
+            def metric(name, kind, description, key):
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} {}".format(name, kind))
+                for endpoint, stats in endpoints:
+                    lines.append('{}{{endpoint="{}"}} {}'.format(
+                        name, endpoint, stats[key]))
+
+            metric("posts_requests_total", "counter",
+                   "Requests handled", "requests")
+            metric("posts_request_errors_total", "counter",
+                   "Requests which failed with a 5xx status", "errors")
+
+            lines.append("# HELP posts_request_seconds Request duration")
+            lines.append("# TYPE posts_request_seconds histogram")
+            for endpoint, stats in endpoints:
+                for bound, count in zip(BUCKETS, stats["buckets"]):
+                    lines.append(
+                        'posts_request_seconds_bucket{{endpoint="{}",'
+                        'le="{}"}} {}'.format(endpoint, bound, count))
+                lines.append('posts_request_seconds_bucket{{endpoint="{}",'
+                             'le="+Inf"}} {}'.format(endpoint,
+                                                    stats["requests"]))
+                lines.append('posts_request_seconds_sum{{endpoint="{}"}} {}'
+                             .format(endpoint, stats["seconds"]))
+                lines.append('posts_request_seconds_count{{endpoint="{}"}} {}'
+                             .format(endpoint, stats["requests"]))
+
+            metric("posts_db_queries_total", "counter",
+                   "SQL statements executed", "queries")
+            metric("posts_db_seconds_total", "counter",
+                   "Time spent executing SQL", "db_seconds")
+            metric("posts_serialize_seconds_total", "counter",
+                   "Time spent serializing JSON", "serialize_seconds")
+
+        stats = cache.post_cache.stats()
+        lines.append("# HELP posts_cache_hits_total Post cache hits")
+        lines.append("# TYPE posts_cache_hits_total counter")
+        lines.append("posts_cache_hits_total {}".format(stats["hits"]))
+        lines.append("# HELP posts_cache_misses_total Post cache misses")
+        lines.append("# TYPE posts_cache_misses_total counter")
+        lines.append("posts_cache_misses_total {}".format(stats["misses"]))
+        return "\n".join(lines) + "\n"
+
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if has_request_context() and "timings" in g:
+        conn.info.setdefault("query_start", []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    if has_request_context() and "timings" in g:
+        g.timings["db"] += time.time() - conn.info["query_start"].pop()
+        g.timings["queries"] += 1
+
+
+def timed(func, key):
+    """ Wrap func to add the time it takes to the request's timings """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not (has_request_context() and "timings" in g):
+            return func(*args, **kwargs)
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            g.timings[key] += time.time() - start
+    return wrapper
+
+
+def start_timer():
+    g.timings = {"start": time.time(), "db": 0.0, "queries": 0,
+                 "serialize": 0.0}
+
+
+def record_timings(response):
+    """
+    Add a Server-Timing header with the time spent in the database and in
+    serialization, and record the request in the metrics
+    """
+    timings = g.get("timings")
+    if timings is None:
+        return response
+    timings["app"] = time.time() - timings["start"]
+    response.headers["Server-Timing"] = ", ".join([
+        "app;dur={:.2f}".format(timings["app"] * 1000),
+        'db;dur={:.2f};desc="{} queries"'.format(timings["db"] * 1000,
+                                                 timings["queries"]),
+        "serialize;dur={:.2f}".format(timings["serialize"] * 1000)
+    ])
+    metrics = current_app.extensions["posts.metrics"]
+    metrics.record(request.endpoint or "unknown", response.status_code,
+                   timings)
+    return response
+
+
+def metrics_get():
+    """ Endpoint with the metrics in the Prometheus text format """
+    metrics = current_app.extensions["posts.metrics"]
+    return Response(metrics.render(), 200,
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def init_app(app):
+    """ Turn on instrumentation if the app config asks for it """
+    if not app.config["INSTRUMENTATION"]:
+        return
+    # Listening on the Engine class covers engines created later on
+    if not event.contains(Engine, "before_cursor_execute",
+                          before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+    dumps, loads = app.extensions["posts.serializers"]
+    app.extensions["posts.serializers"] = (timed(dumps, "serialize"), loads)
+    app.extensions["posts.metrics"] = Metrics()
+    app.before_request(start_timer)
+    app.after_request(record_timings)
+    app.add_url_rule("/metrics", "metrics_get", metrics_get)
@@ -0,0 +1,109 @@
+import time
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g, Response
+from werkzeug.local import LocalProxy
+from werkzeug.utils import import_string
+
+import serializers
+
+
+class RateLimitBackend(object):
+    """ Interface for the rate limiter named by RATE_LIMIT_BACKEND """
+    def take(self, key, rate, burst):
+        """
+        Take a token from the bucket for key, which refills at rate tokens
+        a second up to burst. Returns 0 if a token was taken, else the
+        seconds until one will be available.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class TokenBuckets(RateLimitBackend):
+    """
+    In process token buckets for at most maxkeys clients. The least
+    recently seen client is forgotten when it is full, which at worst
+    gives it a full bucket again.
+    """
+    def __init__(self, maxkeys=100000):
+        self.maxkeys = maxkeys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.maxkeys:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+def create_limiter(config):
+    """ Build the rate limit backend named in the config """
+    backend = import_string(config["RATE_LIMIT_BACKEND"])
+    return backend(maxkeys=config["RATE_LIMIT_MAX_KEYS"])
+
+
+class InFlight(object):
+    """ Count of the requests a process is handling """
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+
+def acquire_slot():
+    """
+    Count the request as in flight, or shed it with a 503 if this process
+    is already handling MAX_CONCURRENT_REQUESTS. Rejecting straight away
+    keeps latency bounded for the requests already admitted instead of
+    queueing every request behind them.
+    """
+    limit = current_app.config["MAX_CONCURRENT_REQUESTS"]
+    if limit is None:
+        return None
+    in_flight = current_app.extensions["posts.in_flight"]
+    with in_flight.lock:
+        if in_flight.count >= limit:
+            retry_after = current_app.config["CONCURRENCY_RETRY_AFTER"]
+            data = serializers.dumps({"message": "Server is busy"})
+            return Response(data, 503, mimetype="application/json",
+                            headers={"Retry-After": str(retry_after)})
+        in_flight.count += 1
+    g.in_flight = True
+
+
+def release_slot(exception=None):
+    """ Stop counting the request once it has been handled """
+    if g.get("in_flight"):
+        g.in_flight = False
+        in_flight = current_app.extensions["posts.in_flight"]
+        with in_flight.lock:
+            in_flight.count -= 1
+
+
+def init_app(app):
+    """ Create the rate limiter and limit requests in flight """
+    app.extensions["posts.limiter"] = create_limiter(app.config)
+    app.extensions["posts.in_flight"] = InFlight()
+    app.before_request(acquire_slot)
+    app.teardown_request(release_slot)
+
+
+# Token buckets keyed by rate limit scope and client, for the current app
+limiter = LocalProxy(lambda: current_app.extensions["posts.limiter"])
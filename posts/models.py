@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, Sequence
+from sqlalchemy import Column, Integer, String, Sequence, ForeignKey
+from sqlalchemy import BigInteger
+from sqlalchemy import DateTime, DDL, Index, event, func
 
 from database import Base
 
@@ -8,6 +10,22 @@ class Post(Base):
     id = Column(Integer, primary_key=True)
     title = Column(String(128))
     body = Column(String(1024))
+    created_at = Column(DateTime, nullable=False, server_default=func.now(),
+                        index=True)
+
+    # Set when a post is soft deleted, the post is hidden until purged
+    deleted_at = Column(DateTime, index=True)
+
+    # Bumped by the ORM on every update, used to build ETags
+    version = Column(Integer, nullable=False, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    # On Postgres text_pattern_ops lets prefix matches (LIKE 'x%') use the
+    # title index whatever the database's collation
+    # ETags are built from the id and version, so SQLite must not hand a
+    # deleted post's id to a new one as it does without AUTOINCREMENT
+    __table_args__ = {"sqlite_autoincrement": True}
 
     def as_dictionary(self):
         post = {
@@ -15,4 +33,59 @@ class Post(Base):
             "title": self.title,
             "body": self.body
         }
-        return post
\ No newline at end of file
+        return post
+
+
+class PostTerm(Base):
+    """ Inverted index entry: a term and the post it appears in """
+    __tablename__ = "post_terms"
+
+    term = Column(String(64), primary_key=True)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"),
+                     primary_key=True, index=True)
+    weight = Column(Integer, nullable=False)
+
+
+class PostChange(Base):
+    """
+    Change log entry: a post which was created or deleted. Entries are
+    numbered in the order they were written so clients can ask for the
+    changes after the last one they saw.
+    """
+    __tablename__ = "post_changes"
+
+    seq = Column(Integer, primary_key=True)
+    post_id = Column(Integer, nullable=False)
+    op = Column(String(16), nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    # Postgres transaction which wrote the entry, see changes.read_changes
+    txid = Column(BigInteger, nullable=False, server_default="0")
+
+    __table_args__ = (Index("ix_post_changes_txid", "txid", "seq"),)
+
+    def as_dictionary(self):
+        return {"seq": self.seq, "post_id": self.post_id, "op": self.op}
+
+
+class PostCounter(Base):
+    """ Running total kept by the writers when POST_COUNTER is on """
+    __tablename__ = "post_counters"
+
+    name = Column(String(32), primary_key=True)
+    value = Column(Integer, nullable=False)
+
+
+# Trigram indexes let Postgres answer title_like and body_like, which are
+# LIKE '%x%' filters, from an index instead of scanning every post
+pg_trgm = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+trigram_indexes = [
+    DDL("CREATE INDEX IF NOT EXISTS ix_posts_{0}_trgm ON posts "
+        "USING gin ({0} gin_trgm_ops)".format(column))
+    for column in ("title", "body")
+]
+
+event.listen(Base.metadata, "before_create",
+             pg_trgm.execute_if(dialect="postgresql"))
+for index in trigram_indexes:
+    event.listen(Post.__table__, "after_create",
+                 index.execute_if(dialect="postgresql"))
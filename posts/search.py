@@ -0,0 +1,112 @@
+import re
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import DDL, event, func, literal_column
+
+import models
+from database import get_engine
+
+
+# Words are runs of letters and digits, anything else separates them
+WORD = re.compile(r"\w+", re.UNICODE)
+
+# Terms in the title count for more than terms in the body
+TITLE_WEIGHT = 2
+BODY_WEIGHT = 1
+
+# Postgres expression the GIN index is built on.  Queries have to use
+# exactly the same expression for the planner to pick the index.
+TSVECTOR = ("to_tsvector('english', coalesce(title, '') || ' ' || "
+            "coalesce(body, ''))")
+
+search_index = DDL("CREATE INDEX IF NOT EXISTS ix_posts_search ON posts "
+                   "USING gin ({})".format(TSVECTOR))
+
+event.listen(models.Post.__table__, "after_create",
+             search_index.execute_if(dialect="postgresql"))
+
+
+def terms(text):
+    """ Split text into lower case terms which fit the post_terms table """
+    return [word[:64] for word in WORD.findall((text or "").lower())]
+
+
+class PostgresIndex(object):
+    """
+    Full text search using a tsvector GIN index. Postgres keeps the index
+    up to date itself as posts are inserted and deleted.
+    """
+    def add(self, session, posts):
+        pass
+
+    def remove(self, session, ids):
+        pass
+
+    def search(self, query, text, limit):
+        vector = literal_column(TSVECTOR)
+        tsquery = func.plainto_tsquery("english", text)
+        rank = func.ts_rank(vector, tsquery)
+        return query.filter(vector.op("@@")(tsquery)). \
+            order_by(rank.desc(), models.Post.id).limit(limit).all()
+
+
+class TermIndex(object):
+    """
+    Full text search using an inverted index kept in the post_terms table,
+    for databases without a native one (e.g. SQLite in tests). Each post
+    has one row per distinct term, weighted by how often it appears.
+    """
+    def add(self, session, posts):
+        """ Index posts given as dictionaries of id, title and body """
+        rows = []
+        for post in posts:
+            weights = Counter()
+            for term in terms(post["title"]):
+                weights[term] += TITLE_WEIGHT
+            for term in terms(post["body"]):
+                weights[term] += BODY_WEIGHT
+            rows.extend({"term": term, "post_id": post["id"],
+                         "weight": weight}
+                        for term, weight in weights.items())
+        if rows:
+            session.execute(models.PostTerm.__table__.insert(), rows)
+
+    def remove(self, session, ids):
+        if ids:
+            session.query(models.PostTerm). \
+                filter(models.PostTerm.post_id.in_(ids)). \
+                delete(synchronize_session=False)
+
+    def search(self, query, text, limit):
+        wanted = set(terms(text))
+        if not wanted:
+            return []
+
+        # Posts which contain every term, ranked by their total weight
+        rank = func.sum(models.PostTerm.weight).label("rank")
+        matches = query.session.query(models.PostTerm.post_id, rank). \
+            filter(models.PostTerm.term.in_(wanted)). \
+            group_by(models.PostTerm.post_id). \
+            having(func.count(models.PostTerm.term) == len(wanted)). \
+            subquery()
+
+        return query.join(matches, models.Post.id == matches.c.post_id). \
+            order_by(matches.c.rank.desc(), models.Post.id). \
+            limit(limit).all()
+
+
+indexes = {
+    "postgresql": PostgresIndex(),
+    "terms": TermIndex()
+}
+
+
+def get_index():
+    """
+    Return the search index for the database in use, or the one named by
+    the SEARCH_BACKEND setting
+    """
+    name = current_app.config.get("SEARCH_BACKEND") or \
+        get_engine().dialect.name
+    return indexes.get(name, indexes["terms"])
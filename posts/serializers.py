@@ -0,0 +1,64 @@
+import json
+
+from flask import current_app, has_app_context
+
+# Accelerated JSON libraries are optional, the fastest one installed is
+# used unless JSON_ENCODER names one
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+encoders = {"json": (json.dumps, json.loads)}
+if ujson:
+    encoders["ujson"] = (ujson.dumps, ujson.loads)
+if orjson:
+    # orjson produces bytes, decode so every encoder returns text
+    encoders["orjson"] = (lambda obj: orjson.dumps(obj).decode("utf-8"),
+                          orjson.loads)
+
+
+def select_encoder(config):
+    """ Return the dumps and loads functions to use for JSON """
+    name = config.get("JSON_ENCODER")
+    if name is None:
+        name = next(name for name in ("orjson", "ujson", "json")
+                    if name in encoders)
+    return encoders[name]
+
+
+def init_app(app):
+    """ Use the JSON library named by the app config """
+    app.extensions["posts.serializers"] = select_encoder(app.config)
+
+
+def encoder():
+    """ The dumps and loads functions of the current app, if there is one """
+    if has_app_context():
+        return current_app.extensions["posts.serializers"]
+    return select_encoder({})
+
+
+def dumps(obj):
+    return encoder()[0](obj)
+
+
+def loads(data):
+    return encoder()[1](data)
+
+
+def post_dict(row, fields=None):
+    """
+    Dictionary for a post from a row of post columns, which avoids
+    building an ORM object for every post in a list. Only the given
+    fields are included if there are any.
+    """
+    if fields is None:
+        return {"id": row.id, "title": row.title, "body": row.body}
+    return {field: getattr(row, field) for field in fields}
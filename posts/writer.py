@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+from Queue import Queue, Empty
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+import bulk
+import cache
+from database import session
+
+
+class WriteTimeout(Exception):
+    """ A post wasn't written within the writer's timeout """
+
+
+class PendingPost(object):
+    """ A post waiting to be written, and the outcome once it has been """
+    def __init__(self, row):
+        self.row = row
+        self.id = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitWriter(object):
+    """
+    Writes posts from many requests in shared transactions. Requests hand
+    their post to a background thread and wait; the thread inserts
+    whatever has queued up, at most max_batch posts or max_delay seconds
+    after the first one, commits once and wakes each request with its new
+    id. One commit then pays for many posts under bursts of writes.
+    """
+    def __init__(self, app, max_batch, max_delay, timeout):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.pid = None
+        self.queue = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, row):
+        """
+        Queue a post row (dict of title and body), wait until it has been
+        committed and return its id. Errors from the batch are raised here,
+        and WriteTimeout if the post wasn't written in time.
+        """
+        self.start()
+        pending = PendingPost(row)
+        self.queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            raise WriteTimeout("Timed out waiting for the post to be written")
+        if pending.error is not None:
+            raise pending.error
+        return pending.id
+
+    def start(self):
+        """
+        Start the writer thread the first time a post is submitted in this
+        process, or again if it has died. Threads don't survive a fork, so
+        a worker forked from a process which already had one starts its
+        own with an empty queue.
+        """
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive():
+                return
+            if self.pid != os.getpid():
+                self.queue = Queue()
+            self.thread = threading.Thread(target=self.run,
+                                           args=(self.queue,))
+            self.thread.daemon = True
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def run(self, queue):
+        with self.app.app_context():
+            while True:
+                batch = self.next_batch(queue)
+                try:
+                    self.write(batch)
+                except Exception as error:
+                    self.app.logger.exception("Writing posts failed")
+                    for pending in batch:
+                        if pending.id is None and pending.error is None:
+                            pending.error = error
+                finally:
+                    # Never leave a request waiting on a post
+                    for pending in batch:
+                        pending.done.set()
+
+    def next_batch(self, queue):
+        """ Wait for a post, then collect more until the batch is due """
+        batch = [queue.get()]
+        deadline = time.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        """
+        Insert and commit a batch of posts. If the transaction fails every
+        post in it fails, as the posts were validated before being queued
+        any error is the database's rather than one post's.
+        """
+        try:
+            ids = bulk.insert_posts(session, [pending.row
+                                              for pending in batch])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.remove()
+
+        # The posts are written whatever happens to the cache
+        for pending, id in zip(batch, ids):
+            pending.id = id
+            pending.done.set()
+        for id in ids:
+            cache.post_cache.delete(id)
+
+
+def init_app(app):
+    """
+    Create the writer used for new posts when GROUP_COMMIT is on. Its
+    thread only starts with the first post.
+    """
+    app.extensions["posts.writer"] = GroupCommitWriter(
+        app, app.config["GROUP_COMMIT_MAX_BATCH"],
+        app.config["GROUP_COMMIT_MAX_DELAY"],
+        app.config["GROUP_COMMIT_TIMEOUT"])
+
+
+# Shared by the request threads of a process, for the current app
+writer = LocalProxy(lambda: current_app.extensions["posts.writer"])
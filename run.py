@@ -1,10 +1,118 @@
 import os
-from posts import app
+import sys
 
 def run():
+    from posts import app
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port)
 
-if __name__ == '__main__':
-    run()
+def run_async():
+    """
+    Serve the app from a single gevent process. Sockets and psycopg2 are
+    patched to yield while they wait, so a request blocked on a slow client
+    or on the database lets the others run and one process keeps hundreds
+    of requests in flight. Sessions are scoped per greenlet, as threading
+    locals are patched too, so give the pool enough connections.
+    """
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        import psycopg2
+    except ImportError:
+        psycopg2 = None
+    if psycopg2:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    from gevent.pywsgi import WSGIServer
+    from posts import app
+    port = int(os.environ.get('PORT', 8080))
+    server = WSGIServer(('0.0.0.0', port), app,
+                        spawn=app.config["ASYNC_MAX_REQUESTS"])
+    server.serve_forever()
+
+def run_production():
+    """
+    Serve the app with gunicorn, pre-forking WORKERS processes (one per CPU
+    by default) which each run WORKER_THREADS threads. The app is loaded in
+    the master before forking so workers share its memory copy-on-write.
+    Send HUP to the master to replace workers gracefully; as the app is
+    preloaded, code changes need a USR2 upgrade instead.
+    """
+    import multiprocessing
+    from gunicorn.app.base import BaseApplication
+    from posts import app
+    from posts import database
+
+    # Connections must not be shared across processes, so the master drops
+    # any it opened while loading and each worker starts with an empty pool
+    def when_ready(server):
+        database.dispose(app)
+
+    def post_fork(server, worker):
+        database.dispose(app)
+
+    options = {
+        "bind": "0.0.0.0:{}".format(os.environ.get('PORT', 8080)),
+        "workers": app.config["WORKERS"] or multiprocessing.cpu_count(),
+        "threads": app.config["WORKER_THREADS"],
+        "preload_app": True,
+        "when_ready": when_ready,
+        "post_fork": post_fork
+    }
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
 
+        def load(self):
+            return app
+
+    Application().run()
+
+def initdb():
+    """
+    Create the database tables, or add what an older release's tables
+    lack, once per deployment
+    """
+    from posts import app
+    from posts.database import upgrade_db
+    upgrade_db(app)
+
+def recount():
+    """ Set the post counter used when POST_COUNTER is on """
+    from posts import app
+    from posts import bulk
+    from posts.database import session
+    with app.app_context():
+        bulk.recount_posts(session)
+        session.commit()
+
+def purge():
+    """
+    Remove soft deleted posts in batches every PURGE_INTERVAL seconds. Run
+    it as a single background process alongside the web servers.
+    """
+    import time
+    from posts import app
+    from posts import bulk
+    from posts.database import session
+    with app.app_context():
+        while True:
+            bulk.purge_deleted(session, app.config["PURGE_BATCH_SIZE"],
+                               app.config["PURGE_AFTER_SECONDS"])
+            session.remove()
+            time.sleep(app.config["PURGE_INTERVAL"])
+
+modes = {
+    "dev": run,
+    "initdb": initdb,
+    "async": run_async,
+    "production": run_production,
+    "purge": purge,
+    "recount": recount
+}
+
+if __name__ == '__main__':
+    modes[sys.argv[1] if len(sys.argv) > 1 else "dev"]()
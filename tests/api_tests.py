@@ -1,14 +1,25 @@
 import unittest
 import os
 import json
+import time
+import zlib
+import threading
 from urlparse import urlparse
 
+from sqlalchemy import create_engine, inspect
+from werkzeug.test import Client, EnvironBuilder
+
 # Configure our app to use the testing databse
 os.environ["CONFIG_PATH"] = "posts.config.TestingConfig"
 
-from posts import app
+from posts import app, create_app
 from posts import models
-from posts.database import Base, engine, session
+from posts import bulk
+from posts import database
+from posts import limits
+from posts import writer
+from posts.cache import post_cache
+from posts.database import Base, get_engine, init_db, session
 
 class TestAPI(unittest.TestCase):
     """ Tests for the posts API """
@@ -19,8 +30,13 @@ class TestAPI(unittest.TestCase):
         """ Test setup """
         self.client = app.test_client()
 
+        # The tests use the app's database and cache outside of requests
+        self.context = app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+
         # Set up the tables in the database
-        Base.metadata.create_all(engine)
+        init_db()
 
 
 
@@ -35,7 +51,9 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(response.mimetype, "application/json")
 
         data = json.loads(response.data)
-        self.assertEqual(data["message"], "Request must accept application/json data")
+        self.assertEqual(data["message"],
+                         "Request must accept application/json or "
+                         "application/x-ndjson data")
 
         
     # Testing API can return empty response
@@ -121,6 +139,82 @@ class TestAPI(unittest.TestCase):
 
 
         
+    # Testing single posts are served from the cache
+    #-----------------------------------------------
+    def test_get_post_cached(self):
+        """ Getting the same post twice only reads the database once """
+        post = models.Post(title="Example Post A", body="Just a test")
+        session.add(post)
+        session.commit()
+
+        hits, misses = post_cache.hits, post_cache.misses
+        for i in range(2):
+            response = self.client.get("/api/posts/{}".format(post.id),
+                                       headers=[("Accept", "application/json")]
+            )
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertEqual(data["title"], "Example Post A")
+
+        self.assertEqual(post_cache.misses - misses, 1)
+        self.assertEqual(post_cache.hits - hits, 1)
+
+
+    # Testing conditional GET with ETags
+    #----------------------------------
+    def test_get_post_not_modified(self):
+        """ Getting a post the client already has returns 304 """
+        post = models.Post(title="Example Post A", body="Just a test")
+        session.add(post)
+        session.commit()
+
+        url = "/api/posts/{}".format(post.id)
+        response = self.client.get(url,
+                                   headers=[("Accept", "application/json")]
+        )
+        etag = response.headers.get("ETag")
+        self.assertTrue(etag)
+
+        response = self.client.get(url,
+                                   headers=[("Accept", "application/json"),
+                                            ("If-None-Match", etag)]
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, "")
+
+
+    def test_get_posts_etag_changes(self):
+        """ The ETag of a list of posts changes when a post is added """
+        postA = models.Post(title="Example Post A", body="Just a test")
+        session.add(postA)
+        session.commit()
+
+        response = self.client.get("/api/posts",
+                                   headers=[("Accept", "application/json")]
+        )
+        etag = response.headers.get("ETag")
+
+        # - Same list gives 304
+        response = self.client.get("/api/posts",
+                                   headers=[("Accept", "application/json"),
+                                            ("If-None-Match", etag)]
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # - New post gives the full list again
+        postB = models.Post(title="Example Post B", body="Another test")
+        session.add(postB)
+        session.commit()
+
+        response = self.client.get("/api/posts",
+                                   headers=[("Accept", "application/json"),
+                                            ("If-None-Match", etag)]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)), 2)
+        self.assertNotEqual(response.headers.get("ETag"), etag)
+
+
     # Testing correct response for nonexistant post
     #----------------------------------------------
     def test_non_existant_post(self):
@@ -167,6 +261,70 @@ class TestAPI(unittest.TestCase):
         self.test_non_existant_post()
 
 
+    def test_delete_many_posts(self):
+        """ Deleting several posts with one request """
+        session.add_all([models.Post(title="Example Post {}".format(i),
+                                     body="Just a test") for i in range(3)])
+        session.commit()
+
+        response = self.client.delete("/api/posts?ids=1,3,7",
+                                      headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data["deleted"], 2)
+
+        posts = session.query(models.Post).all()
+        self.assertEqual([post.id for post in posts], [2])
+
+            # - Invalid ids are rejected
+        response = self.client.delete("/api/posts?ids=1,a",
+                                      headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_soft_delete_and_purge(self):
+        """ Soft deleted posts are hidden until purged """
+        self.addCleanup(app.config.__setitem__, "SOFT_DELETE",
+                        app.config["SOFT_DELETE"])
+        app.config["SOFT_DELETE"] = True
+
+        postA = models.Post(title="Example Post A", body="Just a test")
+        postB = models.Post(title="Example Post B", body="Another test")
+        session.add_all([postA, postB])
+        session.commit()
+
+        response = self.client.delete("/api/post/1",
+                                      headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+
+            # - The post is hidden from reads but still stored
+        response = self.client.get("/api/posts/1",
+                                   headers=[("Accept", "application/json")])
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/api/posts",
+                                   headers=[("Accept", "application/json")])
+        self.assertEqual([post["id"] for post in json.loads(response.data)],
+                         [2])
+        self.assertEqual(session.query(models.Post).count(), 2)
+
+            # - Deleting it again finds nothing
+        response = self.client.delete("/api/post/1",
+                                      headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 404)
+
+            # - Purging removes it for good
+        with app.app_context():
+            purged = bulk.purge_deleted(session, batch_size=1)
+        self.assertEqual(purged, 1)
+        session.expire_all()
+        self.assertEqual([post.id for post in session.query(models.Post)],
+                         [2])
+
+
 
 
     # Testing API returns posts with query strings
@@ -277,6 +435,631 @@ class TestAPI(unittest.TestCase):
 
   
 
+    # Testing API returns posts a page at a time
+    #-------------------------------------------
+    def test_get_posts_paginated(self):
+        """ Paging through posts with limit and after_id """
+
+        # First create number of posts
+        postA = models.Post(title="Example Post A", body="Just a test")
+        postB = models.Post(title="Example Post B", body="Another test")
+        postC = models.Post(title="Example Post C", body="More tests")
+
+        session.add_all([postA, postB, postC])
+        session.commit()
+
+        # Test first page holds two posts and links to the next page
+        response = self.client.get("/api/posts?limit=2",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+
+        posts = json.loads(response.data)
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(posts[0]["title"], "Example Post A")
+        self.assertEqual(posts[1]["title"], "Example Post B")
+
+        link = response.headers.get("Link")
+        self.assertIn('rel="next"', link)
+        next_url = urlparse(link[1:link.index(">")])
+        self.assertEqual(next_url.path, "/api/posts")
+
+        # Test following the link returns the last post and no further link
+        response = self.client.get("{}?{}".format(next_url.path,
+                                                  next_url.query),
+                                   headers=[("Accept", "application/json")]
+        )
+        posts = json.loads(response.data)
+        self.assertEqual(len(posts), 1)
+        self.assertEqual(posts[0]["title"], "Example Post C")
+        self.assertEqual(response.headers.get("Link"), None)
+
+
+    def test_get_posts_invalid_limit(self):
+        """ Paging with a limit which is not a number """
+        response = self.client.get("/api/posts?limit=many",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 400)
+
+        data = json.loads(response.data)
+        self.assertEqual(data["message"], "limit must be an integer")
+
+
+    def test_out_of_range_cursors(self):
+        """ Cursors too big for the database are a 400, not a 500 """
+        for path in ["/api/posts?after_id={}", "/api/posts/changes?since={}",
+                     "/api/posts?ids=1,{}"]:
+            response = self.client.get(path.format(10 ** 20),
+                                       headers=[("Accept",
+                                                 "application/json")]
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.mimetype, "application/json")
+            self.assertIn("out of range", json.loads(response.data)["message"])
+
+
+    # Testing API returns only the fields asked for
+    #---------------------------------------------
+    def test_get_posts_fields(self):
+        """ Getting only the id and title of posts """
+        post = models.Post(title="Example Post A", body="Just a test")
+        session.add(post)
+        session.commit()
+
+        response = self.client.get("/api/posts?fields=id,title",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+
+        posts = json.loads(response.data)
+        self.assertEqual(posts, [{"id": 1, "title": "Example Post A"}])
+
+
+    def test_get_posts_body_preview(self):
+        """ Getting posts with the body cut short """
+        post = models.Post(title="Example Post A", body="Just a test")
+        session.add(post)
+        session.commit()
+
+        response = self.client.get("/api/posts?body_preview=4",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+
+        posts = json.loads(response.data)
+        self.assertEqual(posts[0]["title"], "Example Post A")
+        self.assertEqual(posts[0]["body"], "Just")
+
+
+    def test_get_posts_unknown_field(self):
+        """ Asking for a field posts don't have """
+        response = self.client.get("/api/posts?fields=id,author",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 400)
+
+        data = json.loads(response.data)
+        self.assertEqual(data["message"], "Unknown field author")
+
+
+    # Testing API can stream all posts
+    #---------------------------------
+    def test_get_posts_stream(self):
+        """ Streaming every post as a JSON array """
+        # Small batches so the stream is written in several chunks
+        self.addCleanup(app.config.__setitem__, "POSTS_STREAM_BATCH_SIZE",
+                        app.config["POSTS_STREAM_BATCH_SIZE"])
+        app.config["POSTS_STREAM_BATCH_SIZE"] = 2
+
+        posts = [models.Post(title="Example Post {}".format(i),
+                             body="Just a test")
+                 for i in range(5)]
+        session.add_all(posts)
+        session.commit()
+
+        response = self.client.get("/api/posts?stream=true&limit=1",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/json")
+
+            # - Stream isn't limited to a single page
+        posts = json.loads(response.data)
+        self.assertEqual(len(posts), 5)
+        self.assertEqual(posts[0]["title"], "Example Post 0")
+        self.assertEqual(posts[4]["title"], "Example Post 4")
+
+
+    def test_get_posts_ndjson(self):
+        """ Streaming posts as newline delimited JSON """
+        postA = models.Post(title="Example Post A", body="Just a test")
+        postB = models.Post(title="Example Post B", body="Another test")
+
+        session.add_all([postA, postB])
+        session.commit()
+
+        response = self.client.get("/api/posts",
+                                   headers=[("Accept", "application/x-ndjson")]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+
+        lines = response.data.splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])["title"], "Example Post A")
+        self.assertEqual(json.loads(lines[1])["title"], "Example Post B")
+
+
+    # Testing API compresses large responses
+    #--------------------------------------
+    def test_get_posts_gzip(self):
+        """ Getting posts with gzip compression """
+        posts = [models.Post(title="Example Post {}".format(i),
+                             body="Just a test " * 20)
+                 for i in range(10)]
+        session.add_all(posts)
+        session.commit()
+
+        response = self.client.get("/api/posts",
+                                   headers=[("Accept", "application/json"),
+                                            ("Accept-Encoding", "gzip")]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertIn("Accept-Encoding", response.headers.get("Vary"))
+        self.assertTrue(response.headers.get("ETag").lower().startswith("w/"))
+
+            # - Body decompresses to the posts
+        data = zlib.decompress(response.data, 16 + zlib.MAX_WBITS)
+        self.assertEqual(len(json.loads(data)), 10)
+
+            # - Weak ETag still matches for conditional requests
+        response = self.client.get("/api/posts",
+                                   headers=[("Accept", "application/json"),
+                                            ("Accept-Encoding", "gzip"),
+                                            ("If-None-Match",
+                                             response.headers.get("ETag"))]
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+    # Testing API full text search
+    #-----------------------------
+    def test_search_posts(self):
+        """ Searching posts returns ranked matches """
+
+        # Create posts through the API so they are added to the index
+        posts = [
+            {"title": "Bells", "body": "Only bells here"},
+            {"title": "Bells and whistles", "body": "A test"},
+            {"title": "Whistles", "body": "Just whistles"}
+        ]
+        for post in posts:
+            self.client.post("/api/posts",
+                             data=json.dumps(post),
+                             content_type="application/json",
+                             headers=[("Accept", "application/json")]
+            )
+
+        response = self.client.get("/api/posts?q=whistles",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/json")
+
+        # - Best match comes first
+        posts = json.loads(response.data)
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(posts[0]["title"], "Whistles")
+        self.assertEqual(posts[1]["title"], "Bells and whistles")
+
+        # - Deleted posts drop out of the results
+        self.client.delete("/api/post/{}".format(posts[0]["id"]),
+                           headers=[("Accept", "application/json")]
+        )
+        response = self.client.get("/api/posts?q=whistles",
+                                   headers=[("Accept", "application/json")]
+        )
+        posts = json.loads(response.data)
+        self.assertEqual(len(posts), 1)
+        self.assertEqual(posts[0]["title"], "Bells and whistles")
+        self.assertNotIn("Link", response.headers)
+
+        # - Search results have no pages to follow
+        response = self.client.get("/api/posts?q=whistles&after_id=1",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.mimetype, "application/json")
+
+
+    # Testing request instrumentation
+    #-------------------------------
+    def test_server_timing(self):
+        """ Responses report where the time went """
+        post = models.Post(title="Example Post A", body="Just a test")
+        session.add(post)
+        session.commit()
+
+        response = self.client.get("/api/posts",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+
+        timing = response.headers.get("Server-Timing")
+        self.assertIn("app;dur=", timing)
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="1 queries"', timing)
+        self.assertIn("serialize;dur=", timing)
+
+
+    def test_metrics(self):
+        """ Metrics endpoint counts requests per endpoint """
+        self.client.get("/api/posts",
+                        headers=[("Accept", "application/json")]
+        )
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        self.assertIn('posts_requests_total{endpoint="api.posts_get"}',
+                      response.data)
+        self.assertIn("posts_cache_hits_total", response.data)
+
+
+    # Testing reads are routed to replicas
+    #------------------------------------
+    def test_replica_routing(self):
+        """ GET requests read from a replica unless the client just wrote """
+        self.addCleanup(app.config.__setitem__, "DATABASE_REPLICA_URIS",
+                        app.config["DATABASE_REPLICA_URIS"])
+        self.addCleanup(database.dispose)
+        app.config["DATABASE_REPLICA_URIS"] = (app.config["DATABASE_URI"],)
+
+        # - Writes set the cookie which keeps the client on the primary
+        response = self.client.post("/api/posts",
+                                    data=json.dumps({"title": "Example Post",
+                                                     "body": "Just a test"}),
+                                    content_type="application/json",
+                                    headers=[("Accept", "application/json")]
+        )
+        self.assertIn(database.STICKY_COOKIE,
+                      response.headers.get("Set-Cookie"))
+
+        with app.test_request_context("/api/posts"):
+            self.assertIsNot(database.read_engine(), get_engine())
+
+        with app.test_request_context("/api/posts", headers=[
+                ("Cookie", "{}={}".format(database.STICKY_COOKIE,
+                                          time.time() + 5))]):
+            self.assertIs(database.read_engine(), get_engine())
+
+
+    def test_apps_keep_their_own_state(self):
+        """ Creating another app leaves this one's engine and cache alone """
+        engine = get_engine()
+        other = create_app("posts.config.BenchmarkConfig")
+        self.assertIs(get_engine(), engine)
+        self.assertEqual(str(engine.url), app.config["DATABASE_URI"])
+        self.assertEqual(str(get_engine(other).url),
+                         other.config["DATABASE_URI"])
+        self.assertIsNot(other.extensions["posts.cache"],
+                         app.extensions["posts.cache"])
+
+
+    def test_upgrade_db(self):
+        """ Upgrading adds the columns an older posts table lacks """
+        Base.metadata.drop_all(get_engine())
+        with get_engine().begin() as connection:
+            connection.execute(
+                "CREATE TABLE posts (id INTEGER PRIMARY KEY, "
+                "title VARCHAR(128), body VARCHAR(1024), created_at "
+                "TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)")
+            connection.execute("INSERT INTO posts (id, title, body) "
+                               "VALUES (1, 'Example Post', 'Just a test')")
+            connection.execute("CREATE INDEX ix_posts_title ON posts (title)")
+            connection.execute(
+                "CREATE TABLE post_changes (seq INTEGER PRIMARY KEY, "
+                "post_id INTEGER NOT NULL, op VARCHAR(16) NOT NULL, "
+                "created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)")
+            connection.execute("INSERT INTO post_changes (seq, post_id, op) "
+                               "VALUES (1, 1, 'create')")
+
+        database.upgrade_db()
+        database.upgrade_db()
+        indexes = [index["name"] for index in
+                   inspect(get_engine()).get_indexes("posts")]
+        self.assertNotIn("ix_posts_title", indexes)
+
+        response = self.client.get("/api/posts/1",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get("ETag"), '"1.1"')
+
+        response = self.client.get("/api/posts/changes",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["last_seq"], 1)
+
+
+    def test_deleted_post_ids_not_reused(self):
+        """ A new post never takes a deleted post's id and ETag """
+        response = self.client.post("/api/posts",
+                                    data=json.dumps({"title": "Example Post",
+                                                     "body": "Just a test"}),
+                                    content_type="application/json",
+                                    headers=[("Accept", "application/json")]
+        )
+        response = self.client.get("/api/posts/1",
+                                   headers=[("Accept", "application/json")]
+        )
+        etag = response.headers.get("ETag")
+        self.client.delete("/api/post/1",
+                           headers=[("Accept", "application/json")])
+
+        response = self.client.post("/api/posts",
+                                    data=json.dumps({"title": "Other Post",
+                                                     "body": "Another test"}),
+                                    content_type="application/json",
+                                    headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(json.loads(response.data)["id"], 2)
+
+        response = self.client.get("/api/posts/1",
+                                   headers=[("Accept", "application/json"),
+                                            ("If-None-Match", etag)]
+        )
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get("/api/posts/2",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertNotEqual(response.headers.get("ETag"), etag)
+
+
+    def test_replica_down(self):
+        """ Replicas which can't be reached are skipped """
+        broken = create_engine("sqlite:////nonexistent/replica.db")
+        replicas = database.ReplicaPool([broken], 30)
+        self.assertEqual(replicas.choose(), None)
+
+
+    # Testing posts can be looked up by id
+    #-------------------------------------
+    def test_get_posts_by_ids(self):
+        """ Getting several posts by id in one request """
+        session.add_all([models.Post(title="Example Post {}".format(i),
+                                     body="Just a test") for i in range(3)])
+        session.commit()
+
+        # - Post 2 is served from the cache
+        self.client.get("/api/posts/2",
+                        headers=[("Accept", "application/json")])
+        hits = post_cache.hits
+
+        response = self.client.get("/api/posts?ids=3,2,9,1,3",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([post["id"] for post in data], [3, 2, 1])
+        self.assertEqual(data[0]["title"], "Example Post 2")
+        self.assertEqual(response.headers.get("X-Missing-Ids"), "9")
+        self.assertEqual(post_cache.hits - hits, 1)
+
+            # - Same posts give 304
+        response = self.client.get("/api/posts?ids=3,2,9,1,3",
+                                   headers=[("Accept", "application/json"),
+                                            ("If-None-Match",
+                                             response.headers.get("ETag"))]
+        )
+        self.assertEqual(response.status_code, 304)
+
+            # - Invalid ids are rejected
+        response = self.client.get("/api/posts?ids=1,two",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 400)
+
+            # - Too many ids are refused like too many deletes
+        ids = ",".join(str(i) for i in
+                       range(app.config["POSTS_MAX_PAGE_SIZE"] + 1))
+        response = self.client.get("/api/posts?ids={}".format(ids),
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 413)
+
+            # - List options are refused rather than ignored
+        response = self.client.get("/api/posts?ids=1,2&fields=id",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)["message"],
+                         "fields can't be used with ids")
+
+        response = self.client.get("/api/posts?ids=1,2",
+                                   headers=[("Accept", "application/x-ndjson")]
+        )
+        self.assertEqual(response.status_code, 406)
+
+
+    # Testing posts can be counted
+    #-----------------------------
+    def test_count_posts(self):
+        """ Counting posts with and without filters """
+        session.add_all([
+            models.Post(title="Example Post A", body="Just a test"),
+            models.Post(title="Example Post B", body="Another test"),
+            models.Post(title="Other Post", body="Nothing here")
+        ])
+        session.commit()
+
+        response = self.client.get("/api/posts/count",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {"count": 3})
+
+        response = self.client.get("/api/posts/count?title_like=Example",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(json.loads(response.data), {"count": 2})
+
+        response = self.client.get("/api/posts/stats?body_like=test",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(data["body_length"], {"min": 11, "max": 12,
+                                               "avg": 11.5})
+
+
+    def test_count_posts_counter(self):
+        """ The maintained counter follows creates and deletes """
+        self.addCleanup(app.config.__setitem__, "POST_COUNTER",
+                        app.config["POST_COUNTER"])
+        app.config["POST_COUNTER"] = True
+        with app.app_context():
+            bulk.recount_posts(session)
+            session.commit()
+
+        data = [{"title": "Example Post {}".format(i), "body": "Just a test"}
+                for i in range(3)]
+        self.client.post("/api/posts/bulk", data=json.dumps(data),
+                         content_type="application/json",
+                         headers=[("Accept", "application/json")])
+        self.client.delete("/api/post/2",
+                           headers=[("Accept", "application/json")])
+
+        value = session.query(models.PostCounter.value).scalar()
+        self.assertEqual(value, 2)
+        response = self.client.get("/api/posts/count",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(json.loads(response.data), {"count": 2})
+
+
+    # Testing the change feed
+    #------------------------
+    def test_get_changes(self):
+        """ The change feed lists creates and deletes in order """
+        data = [
+            {"title": "Example Post A", "body": "Just a test"},
+            {"title": "Example Post B", "body": "Another test"}
+        ]
+        self.client.post("/api/posts/bulk", data=json.dumps(data),
+                         content_type="application/json",
+                         headers=[("Accept", "application/json")])
+        self.client.post("/api/posts",
+                         data=json.dumps({"title": "Example Post C",
+                                          "body": "More testing"}),
+                         content_type="application/json",
+                         headers=[("Accept", "application/json")])
+        self.client.delete("/api/post/1",
+                           headers=[("Accept", "application/json")])
+
+        response = self.client.get("/api/posts/changes?since=0",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([(change["post_id"], change["op"])
+                          for change in data["changes"]],
+                         [(1, "create"), (2, "create"), (3, "create"),
+                          (1, "delete")])
+        self.assertEqual(data["last_seq"], data["changes"][-1]["seq"])
+
+            # - Paging with since and limit
+        response = self.client.get("/api/posts/changes?since=1&limit=2",
+                                   headers=[("Accept", "application/json")]
+        )
+        data = json.loads(response.data)
+        self.assertEqual([change["seq"] for change in data["changes"]],
+                         [2, 3])
+
+            # - Long polls with nothing new return empty once they time out
+        start = time.time()
+        response = self.client.get("/api/posts/changes?since=4&wait=0.2",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        data = json.loads(response.data)
+        self.assertEqual(data, {"changes": [], "last_seq": 4})
+
+
+    def test_get_changes_too_many_waiters(self):
+        """ Requests beyond CHANGES_MAX_WAITERS aren't left to wait """
+        waiters = app.extensions["posts.change_waiters"]
+        self.assertTrue(waiters.acquire(app.config["CHANGES_MAX_WAITERS"]))
+        self.addCleanup(waiters.release)
+
+        response = self.client.get("/api/posts/changes?wait=5",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertTrue(response.headers.get("Retry-After"))
+
+            # - Requests which don't wait are still answered
+        response = self.client.get("/api/posts/changes",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+    # Testing clients are rate limited
+    #--------------------------------
+    def test_rate_limit(self):
+        """ Clients over their rate limit get a 429 with Retry-After """
+        self.addCleanup(app.config.__setitem__, "RATE_LIMIT",
+                        app.config["RATE_LIMIT"])
+        self.addCleanup(app.config.__setitem__, "RATE_LIMITS",
+                        app.config["RATE_LIMITS"])
+        self.addCleanup(limits.limiter.clear)
+        app.config["RATE_LIMIT"] = True
+        app.config["RATE_LIMITS"] = {"read": (0.1, 2), "write": (0.1, 2)}
+
+        statuses = []
+        for i in range(3):
+            response = self.client.get("/api/posts",
+                                       headers=[("Accept", "application/json")]
+            )
+            statuses.append(response.status_code)
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(response.headers.get("Retry-After"), "10")
+
+            # - Each scope has its own bucket
+        response = self.client.delete("/api/post/1",
+                                      headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_load_shedding(self):
+        """ Requests over MAX_CONCURRENT_REQUESTS get a 503 """
+        self.addCleanup(app.config.__setitem__, "MAX_CONCURRENT_REQUESTS",
+                        app.config["MAX_CONCURRENT_REQUESTS"])
+        app.config["MAX_CONCURRENT_REQUESTS"] = 0
+
+        response = self.client.get("/api/posts",
+                                   headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers.get("Retry-After"), "1")
+
+            # - Finished requests give their slot back
+        app.config["MAX_CONCURRENT_REQUESTS"] = 1
+        for i in range(2):
+            response = self.client.get("/api/posts",
+                                       headers=[("Accept", "application/json")]
+            )
+            self.assertEqual(response.status_code, 200)
+
+
     # Testing API can post to database 
     # --------------------------------
 
@@ -319,6 +1102,170 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(post.body, "Just a test")
 
 
+    def test_post_put_group_commit(self):
+        """ Posts sent at once are written in shared transactions """
+        self.addCleanup(app.config.__setitem__, "GROUP_COMMIT",
+                        app.config["GROUP_COMMIT"])
+        self.addCleanup(setattr, writer.writer, "max_delay",
+                        writer.writer.max_delay)
+        app.config["GROUP_COMMIT"] = True
+        writer.writer.max_delay = 0.05
+
+        responses = []
+        def post(i):
+            client = app.test_client()
+            responses.append(client.post(
+                "/api/posts",
+                data=json.dumps({"title": "Example Post {}".format(i),
+                                 "body": "Just a test"}),
+                content_type="application/json",
+                headers=[("Accept", "application/json")]))
+
+        threads = [threading.Thread(target=post, args=(i,))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+            # - Every request gets its own id and Location
+        self.assertEqual([response.status_code for response in responses],
+                         [201] * 5)
+        ids = sorted(json.loads(response.data)["id"]
+                     for response in responses)
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+        for response in responses:
+            self.assertEqual(urlparse(response.headers.get("Location")).path,
+                             "/api/posts/{}".format(
+                                 json.loads(response.data)["id"]))
+
+        self.assertEqual(session.query(models.Post).count(), 5)
+
+
+    def test_group_commit_writer_survives_errors(self):
+        """ A failure after a batch commits doesn't stop the writer """
+        class BrokenCache(object):
+            def delete(self, key):
+                raise IOError("cache is down")
+
+        group = writer.GroupCommitWriter(app, 10, 0, 5)
+        post_cache = app.extensions["posts.cache"]
+        app.extensions["posts.cache"] = BrokenCache()
+        app.logger.disabled = True
+        try:
+            first = group.submit({"title": "Example Post A",
+                                  "body": "A test"})
+            second = group.submit({"title": "Example Post B",
+                                   "body": "A test"})
+        finally:
+            app.extensions["posts.cache"] = post_cache
+            app.logger.disabled = False
+        self.assertEqual((first, second), (1, 2))
+        self.assertTrue(group.thread.is_alive())
+
+
+    def test_post_put_group_commit_timeout(self):
+        """ Posts the writer doesn't get to in time give a JSON 503 """
+        self.addCleanup(app.config.__setitem__, "GROUP_COMMIT",
+                        app.config["GROUP_COMMIT"])
+        self.addCleanup(app.extensions.__setitem__, "posts.writer",
+                        app.extensions["posts.writer"])
+        app.config["GROUP_COMMIT"] = True
+        app.extensions["posts.writer"] = writer.GroupCommitWriter(
+            app, 10, 0.2, 0.01)
+
+        response = self.client.post("/api/posts",
+                                    data=json.dumps({"title": "Example Post",
+                                                     "body": "Just a test"}),
+                                    content_type="application/json",
+                                    headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertTrue(response.headers.get("Retry-After"))
+
+        # - Let the late batch finish before the tables are dropped
+        for i in range(50):
+            session.rollback()
+            if session.query(models.Post).count():
+                break
+            time.sleep(0.02)
+
+
+    # Testing API can post many posts at once
+    # ---------------------------------------
+
+    def test_bulk_post_put(self):
+        """ Posting a JSON array of posts """
+        data = [
+            {"title": "Example Post A", "body": "Just a test"},
+            {"title": "Example Post B", "body": "Another test"}
+        ]
+
+        response = self.client.post("/api/posts/bulk",
+                                    data=json.dumps(data),
+                                    content_type="application/json",
+                                    headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.mimetype, "application/json")
+
+            # - Response holds the new ids in order
+        data = json.loads(response.data)
+        self.assertEqual(data["ids"], [1, 2])
+
+            # - Test database contains the posts
+        posts = session.query(models.Post).order_by(models.Post.id).all()
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(posts[0].title, "Example Post A")
+        self.assertEqual(posts[1].body, "Another test")
+
+
+    def test_bulk_post_ndjson(self):
+        """ Posting posts as newline delimited JSON """
+        data = "\n".join([
+            json.dumps({"title": "Example Post A", "body": "Just a test"}),
+            json.dumps({"title": "Example Post B", "body": "Another test"})
+        ])
+
+        response = self.client.post("/api/posts/bulk",
+                                    data=data,
+                                    content_type="application/x-ndjson",
+                                    headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 201)
+
+        posts = session.query(models.Post).all()
+        self.assertEqual(len(posts), 2)
+
+
+    def test_bulk_post_invalid_items(self):
+        """ Posting a batch with invalid posts writes none of them """
+        data = [
+            {"title": "Example Post A", "body": "Just a test"},
+            {"title": "Example Post B", "body": 32},
+            {"title": "Example Post C"}
+        ]
+
+        response = self.client.post("/api/posts/bulk",
+                                    data=json.dumps(data),
+                                    content_type="application/json",
+                                    headers=[("Accept", "application/json")]
+        )
+        self.assertEqual(response.status_code, 422)
+
+            # - Each invalid post is reported with its position
+        data = json.loads(response.data)
+        self.assertEqual(data["errors"], [
+            {"index": 1, "message": "32 is not of type 'string'"},
+            {"index": 2, "message": "'body' is a required property"}
+        ])
+
+            # - Nothing was written
+        posts = session.query(models.Post).all()
+        self.assertEqual(len(posts), 0)
+
+
     # Testing unsupported MIME type
 
     def test_unsupported_mimetype(self):
@@ -372,6 +1319,82 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(data["message"], "32 is not of type 'string'")
 
         
+    # Test oversized JSON data
+
+    def test_title_too_long(self):
+        """ Test endpoint rejects titles longer than the column """
+        data = {
+            "title": "x" * 129,
+            "body": "Just a test"
+        }
+
+        response = self.client.post("api/posts",
+                                    data=json.dumps(data),
+                                    content_type="application/json",
+                                    headers=[("Accept", "application/json")]
+        )
+
+        # Test correct response code returned and nothing written
+        self.assertEqual(response.status_code, 422)
+        data = json.loads(response.data)
+        self.assertIn("is too long", data["message"])
+        self.assertEqual(session.query(models.Post).count(), 0)
+
+
+    def test_request_too_large(self):
+        """ Test endpoint rejects oversized bodies before reading them """
+        data = {
+            "title": "Example Post",
+            "body": "x" * app.config["MAX_POST_LENGTH"]
+        }
+
+        response = self.client.post("api/posts",
+                                    data=json.dumps(data),
+                                    content_type="application/json",
+                                    headers=[("Accept", "application/json")]
+        )
+
+        self.assertEqual(response.status_code, 413)
+        data = json.loads(response.data)
+        self.assertEqual(data["message"],
+                         "Request body must be at most {} bytes".format(
+                             app.config["MAX_POST_LENGTH"]))
+
+
+    def test_chunked_request_too_large(self):
+        """ Test bodies sent without a Content-Length are capped too """
+        def chunked(path, data, content_type):
+            # - As gunicorn and gevent pass chunked bodies to the app
+            environ = EnvironBuilder(path=path, method="POST", data=data,
+                                     content_type=content_type,
+                                     headers=[("Accept",
+                                               "application/json")]
+            ).get_environ()
+            del environ["CONTENT_LENGTH"]
+            environ["wsgi.input_terminated"] = True
+            return Client(app, app.response_class).open(environ)
+
+        data = json.dumps({"title": "Example Post",
+                           "body": "x" * app.config["MAX_POST_LENGTH"]})
+        response = chunked("/api/posts", data, "application/json")
+        self.assertEqual(response.status_code, 413)
+
+        self.addCleanup(app.config.__setitem__, "MAX_BULK_LENGTH",
+                        app.config["MAX_BULK_LENGTH"])
+        app.config["MAX_BULK_LENGTH"] = 100
+        data = json.dumps([{"title": "Example Post {}".format(i),
+                            "body": "Just a test"} for i in range(20)])
+        response = chunked("/api/posts/bulk", data, "application/json")
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(session.query(models.Post).count(), 0)
+
+            # - Bodies within the limit are read as usual
+        data = json.dumps({"title": "Example Post", "body": "Just a test"})
+        response = chunked("/api/posts", data, "application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.data)["title"], "Example Post")
+
+
     # Test missing JSON data
 
     def test_missing_data(self):
@@ -405,8 +1428,9 @@ class TestAPI(unittest.TestCase):
     def tearDown(self):
         """ Test teardown """
         session.close()
+        post_cache.clear()
         # Remove the tables and their data from the database
-        Base.metadata.drop_all(engine)
+        Base.metadata.drop_all(get_engine())
 
 if __name__ == "__main__":
     unittest.main()